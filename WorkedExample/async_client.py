@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import asyncio
+import optparse
+from opentracing import tags
+from opentracing.scope_managers.contextvars import ContextVarsScopeManager
+
+from client_common import AsyncClient
+
+from proton import Url
+
+from proton_tracing import init_tracer
+
+tracer = init_tracer('async-client', scope_manager=ContextVarsScopeManager())
+
+REQUESTS= ["Twas brillig, and the slithy toves",
+           "Did gire and gymble in the wabe.",
+           "All mimsy were the borogroves,",
+           "And the mome raths outgrabe."]
+
+
+async def run(opts, requests):
+    url = Url(opts.address)
+    limit = asyncio.Semaphore(opts.concurrency)
+
+    async def request(client, req):
+        async with limit:
+            reply = await client.call(url.path, req, opts.timeout)
+        if not opts.quiet:
+            print("%s => %s" % (req, reply))
+
+    async with AsyncClient(url, tracer) as client:
+        with tracer.start_active_span('client-requests') as context:
+            # Force trace for this operation
+            context.span.set_tag(tags.SAMPLING_PRIORITY, 1)
+            # Each task starts with a copy of this context, so its requests are children of client-requests
+            results = await asyncio.gather(*(request(client, r) for r in requests), return_exceptions=True)
+    timed_out = sum(isinstance(r, asyncio.TimeoutError) for r in results)
+    if timed_out:
+        print("%d requests timed out" % timed_out)
+    for r in results:
+        if isinstance(r, Exception) and not isinstance(r, asyncio.TimeoutError):
+            raise r
+
+
+parser = optparse.OptionParser(usage="usage: %prog [options]",
+                               description="Send requests concurrently from asyncio tasks and print responses.")
+parser.add_option("-a", "--address", default="localhost:5672/examples",
+                  help="address to which messages are sent (default %default)")
+parser.add_option("-c", "--concurrency", type="int", default=100,
+                  help="maximum number of calls in progress at once (default %default)")
+parser.add_option("-t", "--timeout", type="float", default=None,
+                  help="seconds to wait for each reply (default: forever)")
+parser.add_option("-n", "--repeat", type="int", default=1,
+                  help="number of times to send the requests (default %default)")
+parser.add_option("-q", "--quiet", action="store_true", default=False,
+                  help="don't print the replies")
+opts, args = parser.parse_args()
+
+asyncio.run(run(opts, (args or REQUESTS) * opts.repeat))
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+"""
+Measure what proton_tracing costs on the example message flows.
+
+Each flow is run in a fresh process with tracing disabled, enabled but
+unsampled, and enabled and sampled, reporting to a stand in for the jaeger
+agent that decodes and counts the spans it receives. The sampled-reactor
+mode is sampled with the ReactorScopeManager in place of opentracing's
+thread local one; the scope manager is a small part of the cost of a
+sampled message, and the two sampled rows differ by no more than noise.
+The sampled-file mode records the spans with a FileReporter in a temporary
+directory instead of sending them to the agent.
+The raw-broker flow is the broker flow with the broker forwarding the
+received bytes rather than decoded messages; use a large body size to
+compare the two.
+
+With -n the flow runs on that many containers at once, each on its own
+thread and port in the one process, to check that tracing stays complete
+and see how it scales. The spans column is then the spans the process
+reported, as the stand in agent cannot decode the packets of several
+containers as fast as they arrive. Whenever spans that should have been
+reported are missing the spans column is marked with '!' and the exit
+status is non-zero. The sampled-reactor mode shares one scope stack between
+the threads and so is left out with -n. checks.py checks the traces of
+concurrent containers span by span.
+"""
+
+import collections
+import json
+import optparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from proton import Message
+from proton.handlers import MessagingHandler
+from proton.reactor import Container
+
+FLOWS = ['direct', 'broker', 'raw-broker']
+# Spans each message should produce when sampled
+FLOW_SPANS = {'direct': 2, 'broker': 6, 'raw-broker': 6}
+MODES = ['disabled', 'unsampled', 'sampled', 'sampled-reactor', 'sampled-file']
+
+
+class StandInAgent(object):
+    """
+    Minimal jaeger agent: receives emitBatch UDP packets and counts the spans
+    in them by operation name.
+    """
+    def __init__(self, host='127.0.0.1', port=6831):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.1)
+        self.lock = threading.Lock()
+        self.spans = collections.Counter()
+        self.packets = 0
+        self.errors = 0
+        self.last_packet = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='stand-in-agent', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        from jaeger_client.thrift_gen.agent import Agent
+        from thrift.protocol import TCompactProtocol
+        from thrift.transport import TTransport
+
+        while self.running:
+            try:
+                data = self.socket.recv(65536)
+            except socket.timeout:
+                continue
+            try:
+                protocol = TCompactProtocol.TCompactProtocol(TTransport.TMemoryBuffer(data))
+                protocol.readMessageBegin()
+                args = Agent.emitBatch_args()
+                args.read(protocol)
+                operations = collections.Counter(s.operationName for s in args.batch.spans)
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                continue
+            with self.lock:
+                self.packets += 1
+                self.spans.update(operations)
+                self.last_packet = time.monotonic()
+
+    def take(self, quiet=0.2):
+        """
+        Wait until no packets arrived for quiet seconds then return and reset the counts
+        """
+        while time.monotonic() - self.last_packet < quiet:
+            time.sleep(quiet)
+        with self.lock:
+            spans, self.spans = self.spans, collections.Counter()
+            self.packets = 0
+            return spans
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+
+class Client(MessagingHandler):
+    """
+    Sends count messages stamped with their send time and, if receive is set,
+    receives them back from the same address
+    """
+    def __init__(self, count, stats, receive, done, body_size=0):
+        super(Client, self).__init__()
+        self.payload = b'x' * body_size
+        self.count = count
+        self.stats = stats
+        self.receive = receive
+        self.done = done
+        self.sent = 0
+        self.accepted = 0
+
+    def start(self, container, url, address):
+        self.connection = container.connect(url, handler=self)
+        if self.receive:
+            container.create_receiver(self.connection, address)
+        container.create_sender(self.connection, address)
+
+    def on_sendable(self, event):
+        while event.sender.credit and self.sent < self.count:
+            self.sent += 1
+            event.sender.send(Message(body={'sequence': self.sent, 'sent': time.perf_counter(),
+                                            'payload': self.payload}))
+
+    def on_message(self, event):
+        self.stats.received(event.message)
+        self.check_done()
+
+    def on_accepted(self, event):
+        self.accepted += 1
+        self.check_done()
+
+    def check_done(self):
+        if self.accepted == self.count and (not self.receive or self.stats.count == self.count):
+            self.connection.close()
+            self.done()
+
+
+class Stats(object):
+    def __init__(self):
+        self.latencies = []
+        self.count = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.count += other.count
+
+    def received(self, message):
+        self.latencies.append(time.perf_counter() - message.body['sent'])
+        self.count += 1
+
+    def percentile(self, p):
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100.0))]
+
+
+class Sink(MessagingHandler):
+    """
+    Direct flow: listens and receives the client's messages itself
+    """
+    def __init__(self, url, count, stats, body_size):
+        super(Sink, self).__init__()
+        self.url = url
+        self.stats = stats
+        self.client = Client(count, stats, False, self.stop, body_size)
+
+    def on_start(self, event):
+        self.acceptor = event.container.listen(self.url)
+        self.client.start(event.container, self.url, 'bench')
+
+    def on_message(self, event):
+        self.stats.received(event.message)
+        self.client.check_done()
+
+    def stop(self):
+        self.acceptor.close()
+
+
+def broker_flow(url, count, stats, body_size, raw):
+    import broker
+
+    class BenchBroker(broker.Broker):
+        def on_start(self, event):
+            super(BenchBroker, self).on_start(event)
+            self.client = Client(count, stats, True, self.acceptor.close, body_size)
+            self.client.start(event.container, self.url, 'bench')
+
+    return BenchBroker(url, raw=raw)
+
+
+def run(flow, mode, count, url, body_size=0, containers=1):
+    """
+    Run one flow in this process, on each of containers threads listening
+    on successive ports, and return its measurements
+    """
+    import proton_tracing
+    reporter = None
+    if mode == 'disabled':
+        proton_tracing.disable()
+    else:
+        scope_manager = proton_tracing.ReactorScopeManager() if mode == 'sampled-reactor' else None
+        if mode == 'sampled-file':
+            reporter = proton_tracing.FileReporter(tempfile.mkdtemp(prefix='benchmark-spans-'))
+        proton_tracing.init_tracer('benchmark', sampler=proton_tracing.ConstSampler(mode != 'unsampled'),
+                                   scope_manager=scope_manager, reporter=reporter)
+    host, port = url.rsplit(':', 1)
+    all_stats = [Stats() for _ in range(containers)]
+    handlers = []
+    for i, stats in enumerate(all_stats):
+        container_url = '%s:%d' % (host, int(port) + i)
+        if flow == 'direct':
+            handlers.append(Sink(container_url, count, stats, body_size))
+        else:
+            handlers.append(broker_flow(container_url, count, stats, body_size, flow == 'raw-broker'))
+    threads = [threading.Thread(target=Container(h).run, name='container-%d' % i) for i, h in enumerate(handlers)]
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+    proton_tracing.flush_tracer(10)
+    stats = Stats()
+    for s in all_stats:
+        stats.merge(s)
+    result = {
+        'flow': flow, 'mode': mode, 'messages': stats.count,
+        'rate': stats.count / wall,
+        'cpu_us': cpu / stats.count * 1e6,
+        'p50_us': stats.percentile(50) * 1e6,
+        'p99_us': stats.percentile(99) * 1e6
+    }
+    if reporter is not None:
+        result['spans'] = reporter.written
+        shutil.rmtree(reporter.directory)
+    elif containers > 1 and mode != 'disabled':
+        result['spans'] = proton_tracing.get_tracer().reporter.sent
+    return result
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]",
+                                   description="Measure the cost of message tracing on the example flows.")
+    parser.add_option("-m", "--messages", type="int", default=10000,
+                      help="number of messages per run (default %default)")
+    parser.add_option("-s", "--body-size", type="int", default=0,
+                      help="bytes of padding in each message body (default %default)")
+    parser.add_option("-a", "--address", default="localhost:5699",
+                      help="address the benchmark listens on, counting up the ports for each container (default %default)")
+    parser.add_option("-n", "--containers", type="int", default=1,
+                      help="containers running the flow at once, each on its own thread (default %default)")
+    parser.add_option("-p", "--agent-port", type="int", default=6831,
+                      help="UDP port of the stand in jaeger agent (default %default)")
+    parser.add_option("-f", "--flow", action="append", choices=FLOWS,
+                      help="flow to run, may be repeated (default all of %s)" % ', '.join(FLOWS))
+    parser.add_option("--mode", action="append", choices=MODES,
+                      help="tracing mode to run, may be repeated (default all of %s)" % ', '.join(MODES))
+    parser.add_option("--child", action="store_true", default=False,
+                      help=optparse.SUPPRESS_HELP)
+    opts, args = parser.parse_args()
+    modes = opts.mode or MODES
+    if opts.containers > 1:
+        if opts.mode and 'sampled-reactor' in opts.mode:
+            parser.error('the sampled-reactor mode cannot run on more than one container')
+        modes = [m for m in modes if m != 'sampled-reactor']
+
+    if opts.child:
+        print(json.dumps(run(opts.flow[0], opts.mode[0], opts.messages, opts.address, opts.body_size,
+                             opts.containers)))
+        return
+
+    agent = StandInAgent(port=opts.agent_port)
+    env = dict(os.environ, JAEGER_AGENT_HOST='127.0.0.1', JAEGER_AGENT_PORT=str(opts.agent_port))
+    print("%-10s %-15s %10s %10s %10s %10s %8s" % ('flow', 'mode', 'msgs/s', 'cpu us/msg', 'p50 us', 'p99 us', 'spans'))
+    missing = 0
+    for flow in opts.flow or FLOWS:
+        for mode in modes:
+            env['PROTON_TRACING'] = '0' if mode == 'disabled' else '1'
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--child', '-f', flow, '--mode', mode,
+                 '-m', str(opts.messages), '-s', str(opts.body_size), '-a', opts.address,
+                 '-n', str(opts.containers)], env=env)
+            r = json.loads(output.splitlines()[-1])
+            spans = r.get('spans', sum(agent.take().values()))
+            expected = r['messages'] * FLOW_SPANS[flow] if mode.startswith('sampled') else 0
+            if spans < expected:
+                missing += 1
+            print("%-10s %-15s %10.0f %10.1f %10.0f %10.0f %8d%s" %
+                  (flow, mode, r['rate'], r['cpu_us'], r['p50_us'], r['p99_us'], spans,
+                   '!' if spans < expected else ''))
+    agent.close()
+    if missing:
+        sys.exit('spans missing from %d run%s' % (missing, '' if missing == 1 else 's'))
+
+
+if __name__ == '__main__':
+    main()
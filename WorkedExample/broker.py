@@ -19,99 +19,393 @@
 #
 
 import collections
+import functools
+import multiprocessing
 import optparse
+import signal
+import time
 import uuid
+import weakref
+import zlib
 
 from opentracing import follows_from
 
-from proton import Endpoint
-from proton.handlers import MessagingHandler
+import proton.handlers
+from proton import Condition, Delivery, Endpoint, Message, Url, symbol, ushort
+from proton.handlers import MessagingHandler, Reject, Release
 from proton.reactor import Container
-from proton.tracing import init_tracer
+import proton_tracing
+from proton_tracing import Histogram, init_tracer, serve_metrics, stamp_transit, tracer
 
-tracer = init_tracer('broker')
+from flow_control import AdaptiveFlowController
+from queue_store import Fifo, PriorityQueue, SpillQueue
+from raw_message import RawMessage
+from timer_wheel import TimerWheel
 
 class Queue(object):
-    def __init__(self, dynamic=False):
+    """
+    Messages are dispatched highest priority first, and those with a time
+    to live are dropped once it has passed: by ``expiry`` from the default
+    in memory store, otherwise when they come to be dispatched. A dropped
+    message gets an ``expire-message`` span tagged ``expired`` following
+    from its queue span.
+
+    :param metrics: if True record how long messages stay queued in the
+        ``residence`` histogram and only emit queue spans for sampled traces
+    :param new_store: function returning the storage for one priority level,
+        with the deque interface (for example a :class:`SpillQueue`); an in
+        memory :class:`Fifo` by default
+    :param span_tags: tags added to the queue spans
+    :param transit: if True add the times messages carrying transit
+        timestamps are queued and dequeued to them
+    :param expiry: the :class:`ExpiryTimer` expiring messages
+    """
+    def __init__(self, dynamic=False, metrics=False, new_store=None, span_tags=None, transit=False,
+                 expiry=None):
         self.dynamic = dynamic
-        self.queue = collections.deque()
-        self.consumers = []
+        self.metrics = metrics
+        self.span_tags = span_tags
+        self.transit = transit
+        self.expiry = expiry
+        self.residence = Histogram() if metrics else None
+        self.queue = PriorityQueue(new_store or Fifo)
+        self.published = 0
+        self.dispatched = 0
+        self.expired = 0
+        # Dict keys used as a set, for O(1) unsubscribe
+        self.consumers = {}
+        # Consumers with credit in round robin order (dict keys used as an ordered set)
+        self.ready = collections.OrderedDict()
+        # Producers held back by the messages waiting here (dict keys used as a set)
+        self.waiting = {}
 
     def subscribe(self, consumer):
-        self.consumers.append(consumer)
+        self.consumers[consumer] = None
+        if consumer.credit:
+            self.ready[consumer] = None
 
     def unsubscribe(self, consumer):
         """
         :return: True if the queue is to be deleted
         """
-        if consumer in self.consumers:
-            self.consumers.remove(consumer)
+        self.consumers.pop(consumer, None)
+        self.ready.pop(consumer, None)
         return len(self.consumers) == 0 and (self.dynamic or len(self.queue) == 0)
 
+    def _tags(self):
+        # The tracer takes ownership of the tags it is given
+        return dict(self.span_tags) if self.span_tags else None
+
+    def depth(self):
+        return len(self.queue)
+
+    def delete(self):
+        self.queue.close()
+
     def publish(self, message):
-        span = tracer.start_span('queue-message')
+        self.published += 1
+        if self.transit:
+            stamp_transit(message)
+        ttl = message.ttl
+        message.expires = time.monotonic() + ttl if ttl else None
+        if self.metrics:
+            message.enqueued = time.monotonic()
+            # Only trace messages received as part of a sampled trace. The
+            # context of an unsampled one is kept so that the consumer's
+            # copy is marked unsampled too, not sampled afresh
+            parent = tracer.active_span
+            if not proton_tracing.is_sampled(parent):
+                message.qspan = parent
+                self._append(message)
+                self.dispatch()
+                return
+        span = tracer.start_span('queue-message', tags=self._tags())
         message.qspan = span
         with tracer.scope_manager.activate(span, True):
-            self.queue.append(message)
+            self._append(message)
         self.dispatch()
 
+    def _append(self, message):
+        token = self.queue.append(message, message.priority)
+        if message.expires is not None and token is not None and self.expiry is not None:
+            self.expiry.add(message.expires, self, token)
+
+    def expire(self, token):
+        """
+        Drop a message whose time to live has passed, if it is still queued
+
+        :return: True if it was
+        """
+        message = self.queue.remove(token)
+        if message is None:
+            return False
+        self._expired(message)
+        return True
+
+    def _expired(self, message):
+        self.expired += 1
+        if message.qspan is not None:
+            tags = self._tags() or {}
+            tags['expired'] = True
+            tracer.start_span('expire-message', ignore_active_span=True,
+                              references=follows_from(message.qspan.context), tags=tags).finish()
+
     def dispatch(self, consumer=None):
-        if consumer:
-            c = [consumer]
-        else:
-            c = self.consumers
-        while self._deliver_to(c):
-            pass
+        """
+        Deliver queued messages to the consumers with credit, taking them in
+        turn so that the cost per message does not depend on how many
+        consumers there are.
+
+        :param consumer: a consumer whose credit may have changed
+        """
+        if consumer is not None and consumer.credit and consumer not in self.ready:
+            self.ready[consumer] = None
+        queue = self.queue
+        ready = self.ready
+        while queue and ready:
+            c = ready.popitem(last=False)[0]
+            if not c.credit:
+                continue
+            msg = queue.popleft()
+            if msg.expires is not None and msg.expires <= time.monotonic():
+                # Not yet dropped by the timer, or read back from disk; the
+                # consumer keeps its turn
+                self._expired(msg)
+                ready[c] = None
+                ready.move_to_end(c, last=False)
+                continue
+            self.dispatched += 1
+            if self.metrics:
+                self.residence.record(time.monotonic() - msg.enqueued)
+            if self.transit:
+                stamp_transit(msg)
+            if msg.qspan is None:
+                c.send(msg)
+            else:
+                with tracer.start_active_span('dequeue-message', ignore_active_span=True, references=follows_from(msg.qspan.context), tags=self._tags()):
+                    c.send(msg)
+            if c.credit:
+                ready[c] = None
+
 
-    def _deliver_to(self, consumers):
+# Subclasses the tracing handler (once proton_tracing has replaced proton's)
+# so that raw messages are traced too
+class RawMessageHandler(proton.handlers.IncomingMessageHandler):
+    """
+    Incoming message handler giving the delegate each message as a
+    :class:`RawMessage` rather than decoding it
+    """
+    def on_delivery(self, event):
+        dlv = event.delivery
+        link = dlv.link
+        if not link.is_receiver or dlv.aborted or not dlv.readable or dlv.partial:
+            super(RawMessageHandler, self).on_delivery(event)
+            return
+        event.message = RawMessage(link.recv(dlv.pending))
+        link.advance()
+        if link.state & Endpoint.LOCAL_CLOSED:
+            if self.auto_accept:
+                dlv.update(Delivery.RELEASED)
+                dlv.settle()
+            return
         try:
-            result = False
-            for c in consumers:
-                if c.credit:
-                    msg = self.queue.popleft()
-                    with tracer.start_active_span('dequeue-message', ignore_active_span=True, references=follows_from(msg.qspan.context)):
-                        c.send(msg)
-                        result = True
-            return result
-        except IndexError:  # no more messages
-            return False
+            self.on_message(event)
+            if self.auto_accept:
+                dlv.update(Delivery.ACCEPTED)
+                dlv.settle()
+        except Reject:
+            dlv.update(Delivery.REJECTED)
+            dlv.settle()
+        except Release:
+            dlv.update(Delivery.MODIFIED)
+            dlv.settle()
+
+
+class ConsumerIndex(object):
+    """
+    The broker's consumer links by connection, each with the address and
+    queue it is subscribed to.
+
+    A connection's consumers are found without walking its links, and
+    removing a consumer or connection that has already gone does nothing.
+    """
+    def __init__(self):
+        self.connections = {}
+
+    def add(self, link, address, queue):
+        connection = link.connection
+        links = self.connections.get(connection)
+        if links is None:
+            links = self.connections[connection] = {}
+        links[link] = (address, queue)
+
+    def remove(self, link):
+        """
+        :return: the (address, queue) the link was subscribed to, or None
+        """
+        connection = link.connection
+        links = self.connections.get(connection)
+        if links is None:
+            return None
+        entry = links.pop(link, None)
+        if not links:
+            del self.connections[connection]
+        return entry
+
+    def remove_connection(self, connection):
+        """
+        :return: list of (link, (address, queue)) for the connection's consumers
+        """
+        links = self.connections.pop(connection, None)
+        return list(links.items()) if links else []
+
+
+class QueueStats(object):
+    """
+    Timer task periodically printing the depth and residence time of each queue
+    """
+    def __init__(self, broker, interval):
+        self.broker = broker
+        self.interval = interval
+
+    def on_timer_task(self, event):
+        for address, q in sorted(self.broker.queues.items()):
+            s = q.residence.summary((50, 99))
+            if s['count']:
+                print("%s: depth=%d dequeued=%d expired=%d residence p50=%.6fs p99=%.6fs max=%.6fs" %
+                      (address, q.depth(), s['count'], q.expired, s['p50'], s['p99'], s['max']))
+            else:
+                print("%s: depth=%d dequeued=0 expired=%d" % (address, q.depth(), q.expired))
+            q.residence.reset()
+        event.container.schedule(self.interval, self)
+
+
+class ExpiryTimer(object):
+    """
+    Timer task dropping queued messages whose time to live has passed, from
+    a :class:`TimerWheel` advanced every ``tick`` seconds while it holds any
+    """
+    def __init__(self, broker, tick=0.1):
+        self.broker = broker
+        self.wheel = TimerWheel(tick)
+        self.container = None
+        self.scheduled = False
+
+    def add(self, deadline, queue, token):
+        self.wheel.add(deadline, (queue, token))
+        if not self.scheduled and self.container is not None:
+            self.container.schedule(self.wheel.tick, self)
+            self.scheduled = True
+
+    def on_timer_task(self, event):
+        expired = {}
+        for queue, token in self.wheel.advance():
+            if queue.expire(token):
+                expired[queue] = None
+        for queue in expired:
+            self.broker.replenish(queue)
+        self.scheduled = self.wheel.pending > 0
+        if self.scheduled:
+            event.container.schedule(self.wheel.tick, self)
 
 
 class Broker(MessagingHandler):
-    def __init__(self, url):
-        super(Broker, self).__init__()
+    """
+    :param spill_dir: if set, queues keep at most ``memory_limit`` messages in
+        memory and spill the rest to segment files in this directory
+    :param metrics_port: if set, serve the tracing and queue metrics for
+        Prometheus on this port
+    :param raw: if True forward messages as the bytes received, decoding
+        only their annotations (and the address for anonymous links)
+    :param credit: if set, the fixed credit window of each incoming link;
+        otherwise it is sized by an :class:`AdaptiveFlowController`, with
+        the messages waiting on a queue that has consumers counted against
+        the credit of the links sending to it
+    :param transit: if True stamp messages carrying transit timestamps when
+        they are queued and dequeued, so receivers can tell the hops apart
+    """
+    def __init__(self, url, metrics=False, stats_interval=None, spill_dir=None, memory_limit=10000,
+                 metrics_port=None, raw=False, credit=None, transit=False):
+        super(Broker, self).__init__(prefetch=credit or 0)
         self.url = url
+        self.metrics = metrics
+        self.stats_interval = stats_interval
+        self.spill_dir = spill_dir
+        self.memory_limit = memory_limit
+        self.metrics_port = metrics_port
+        self.raw = raw
+        self.transit = transit
+        self.flow_control = None
+        if not credit:
+            self.flow_control = AdaptiveFlowController(backlog=self._backlog, registry=proton_tracing.metrics,
+                                                       name='broker_incoming').install(self)
+        if raw:
+            self.handlers = [RawMessageHandler(h.auto_accept, h.delegate)
+                             if isinstance(h, proton.handlers.IncomingMessageHandler) else h
+                             for h in self.handlers]
+        self.span_tags = None
         self.queues = {}
+        self.consumers = ConsumerIndex()
+        self.expiry = ExpiryTimer(self)
+        _brokers.add(self)
 
     def on_start(self, event):
         self.acceptor = event.container.listen(self.url)
+        self.expiry.container = event.container
+        if self.metrics_port:
+            serve_metrics(self.metrics_port)
+        if self.metrics and self.stats_interval:
+            event.container.schedule(self.stats_interval, QueueStats(self, self.stats_interval))
+
+    def _new_queue(self, dynamic=False):
+        new_store = None
+        if self.spill_dir:
+            new_store = functools.partial(SpillQueue, tracer, self.spill_dir, self.memory_limit,
+                                          message_type=RawMessage if self.raw else Message)
+        return Queue(dynamic, self.metrics, new_store, self.span_tags, self.transit, self.expiry)
+
+    def _dynamic_address(self):
+        return str(uuid.uuid4())
 
     def _queue(self, address):
         if address not in self.queues:
-            self.queues[address] = Queue()
+            self.queues[address] = self._new_queue()
         return self.queues[address]
 
     def on_link_opening(self, event):
         if event.link.is_sender:
             if event.link.remote_source.dynamic:
-                address = str(uuid.uuid4())
+                address = self._dynamic_address()
                 event.link.source.address = address
-                q = Queue(True)
+                q = self._new_queue(True)
                 self.queues[address] = q
-                q.subscribe(event.link)
+                self._subscribe(event.link, address, q)
             elif event.link.remote_source.address:
-                event.link.source.address = event.link.remote_source.address
-                self._queue(event.link.source.address).subscribe(event.link)
+                address = event.link.remote_source.address
+                event.link.source.address = address
+                self._subscribe(event.link, address, self._queue(address))
         elif event.link.remote_target.address:
             event.link.target.address = event.link.remote_target.address
 
-    def _unsubscribe(self, link):
-        if link.source.address in self.queues and self.queues[link.source.address].unsubscribe(link):
-            del self.queues[link.source.address]
+    def _subscribe(self, link, address, queue):
+        queue.subscribe(link)
+        self.consumers.add(link, address, queue)
+
+    def _unsubscribe(self, link, address, queue):
+        # The address may have a new queue by now if this one was deleted
+        if queue.unsubscribe(link) and self.queues.get(address) is queue:
+            del self.queues[address]
+            queue.delete()
+        if not queue.consumers:
+            # Without consumers it no longer holds back its producers, and
+            # they have nothing in flight to trigger a top up
+            self.replenish(queue)
 
     def on_link_closing(self, event):
         if event.link.is_sender:
-            self._unsubscribe(event.link)
+            entry = self.consumers.remove(event.link)
+            if entry is not None:
+                self._unsubscribe(event.link, *entry)
 
     def on_connection_closing(self, event):
         self.remove_stale_consumers(event.connection)
@@ -120,30 +414,253 @@ class Broker(MessagingHandler):
         self.remove_stale_consumers(event.connection)
 
     def remove_stale_consumers(self, connection):
-        l = connection.link_head(Endpoint.REMOTE_ACTIVE)
-        while l:
-            if l.is_sender:
-                self._unsubscribe(l)
-            l = l.next(Endpoint.REMOTE_ACTIVE)
+        # Called on both closing and disconnect; the second call finds nothing
+        for link, (address, queue) in self.consumers.remove_connection(connection):
+            self._unsubscribe(link, address, queue)
+
+    def _backlog(self, link):
+        # A queue with consumers only takes messages as fast as they do;
+        # without them, or when spilling to disk, it stores what it is sent
+        address = link.target.address
+        q = self.queues.get(address) if address else None
+        if q is None or not q.consumers or self.spill_dir:
+            return 0
+        depth = q.depth()
+        if depth:
+            q.waiting[link] = None
+        return depth
 
     def on_sendable(self, event):
-        self._queue(event.link.source.address).dispatch(event.link)
+        address = event.link.source.address
+        if address is None:
+            # Not a consumer, for example a sharded broker's forwarder
+            return
+        q = self._queue(address)
+        q.dispatch(event.link)
+        self.replenish(q)
 
-    def on_message(self, event):
+    def replenish(self, q):
+        """
+        Top up the credit of the producers held back by a queue that has gone down
+        """
+        if q.waiting:
+            waiting, q.waiting = q.waiting, {}
+            for link in waiting:
+                self.flow_control.replenish(link)
+
+    def _address(self, event):
+        """
+        :return: the address a received message is for
+        :raise Reject: if it has none, being sent on an anonymous link
+            without one
+        """
         address = event.link.target.address
         if address is None:
             address = event.message.address
-        self._queue(address).publish(event.message)
+            if address is None:
+                raise Reject()
+        return address
+
+    def on_message(self, event):
+        self._queue(self._address(event)).publish(event.message)
+
+
+# Brokers in this process, whose queues the queue metrics cover
+_brokers = weakref.WeakSet()
+
+def _per_queue(value):
+    # Called from the metrics thread, so copy the brokers and queues first
+    return dict(((broker.url, address), value(q))
+                for broker in list(_brokers) for address, q in list(broker.queues.items()))
+
+_labels = ('broker', 'address')
+proton_tracing.metrics.gauge('broker_queue_depth', 'Messages waiting on the queue',
+                             lambda: _per_queue(Queue.depth), label=_labels)
+proton_tracing.metrics.counter('broker_queue_published_total', 'Messages published to the queue',
+                               lambda: _per_queue(lambda q: q.published), label=_labels)
+proton_tracing.metrics.counter('broker_queue_dispatched_total', 'Messages sent from the queue to consumers',
+                               lambda: _per_queue(lambda q: q.dispatched), label=_labels)
+proton_tracing.metrics.counter('broker_queue_expired_total',
+                               'Messages dropped from the queue when their time to live passed',
+                               lambda: _per_queue(lambda q: q.expired), label=_labels)
+proton_tracing.metrics.gauge('broker_queue_consumers', 'Consumers subscribed to the queue',
+                             lambda: _per_queue(lambda q: len(q.consumers)), label=_labels)
+
+
+def shard_for(address, shards):
+    """
+    :return: the index of the shard owning address
+    """
+    return zlib.crc32(address.encode('utf-8')) % shards
+
+
+class ShardedBroker(Broker):
+    """
+    One of ``shards`` broker processes, each owning the queues whose address
+    hashes to it (see :func:`shard_for`) and listening on the base url's port
+    plus its shard index.
+
+    Links attaching to an address owned by another shard are refused with an
+    ``amqp:link:redirect`` error naming the owning shard. Messages for other
+    shards arriving on anonymous links (for example replies) are forwarded.
+    Queue spans are tagged with the shard index.
+    """
+    def __init__(self, url, shard, shards, **kwargs):
+        base = Url(url)
+        self.host = base.host
+        self.base_port = int(base.port)
+        if kwargs.get('metrics_port'):
+            kwargs['metrics_port'] += shard
+        super(ShardedBroker, self).__init__(self._shard_url(shard), **kwargs)
+        self.shard = shard
+        self.shards = shards
+        self.span_tags = {'broker.shard': shard}
+        self.forwarders = {}
+
+    def _shard_url(self, shard):
+        return '%s:%d' % (self.host, self.base_port + shard)
+
+    def on_start(self, event):
+        super(ShardedBroker, self).on_start(event)
+        self.container = event.container
+
+    def _dynamic_address(self):
+        while True:
+            address = str(uuid.uuid4())
+            if shard_for(address, self.shards) == self.shard:
+                return address
+
+    def on_link_remote_open(self, event):
+        # Seen before the child handlers, so a link for another shard's
+        # address is refused before any flow controller gives it credit
+        link = event.link
+        if not link.state & Endpoint.LOCAL_UNINIT:
+            return
+        if link.is_sender:
+            address = None if link.remote_source.dynamic else link.remote_source.address
+        else:
+            address = link.remote_target.address
+        owner = self.shard if not address else shard_for(address, self.shards)
+        if owner == self.shard:
+            return
+        link.redirect = (address, owner)
+        info = {
+            symbol('network-host'): self.host,
+            symbol('port'): ushort(self.base_port + owner),
+            symbol('address'): address
+        }
+        link.source.copy(link.remote_source)
+        link.target.copy(link.remote_target)
+        link.open()
+        link.condition = Condition('amqp:link:redirect', 'address %s is owned by shard %d' % (address, owner), info)
+        link.close()
+
+    def on_sendable(self, event):
+        if getattr(event.link, 'redirect', None) is None:
+            super(ShardedBroker, self).on_sendable(event)
+
+    def _forward(self, owner, message):
+        sender = self.forwarders.get(owner)
+        if sender is None:
+            sender = self.container.create_sender(self._shard_url(owner))
+            self.forwarders[owner] = sender
+        sender.send(message)
+
+    def on_message(self, event):
+        address = self._address(event)
+        owner = shard_for(address, self.shards)
+        if owner == self.shard:
+            self._queue(address).publish(event.message)
+        else:
+            self._forward(owner, event.message)
+
+
+def init_broker_tracer(tail_latency=None):
+    """
+    :param tail_latency: if set, only export traces with a span slower than
+        this many seconds or a failed delivery
+    """
+    if tail_latency is not None and proton_tracing.enabled():
+        init_tracer('broker', sampler=proton_tracing.ConstSampler(True),
+                    reporter=proton_tracing.TailSamplingReporter(latency_threshold=tail_latency))
+    else:
+        init_tracer('broker')
+
+
+def run_shard(url, shard, shards, tail_latency, kwargs):
+    init_broker_tracer(tail_latency)
+    # Stop as for Ctrl-C, so the shard's spans are flushed on the way out
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        Container(ShardedBroker(url, shard, shards, **kwargs)).run()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_sharded(url, shards, tail_latency=None, **kwargs):
+    """
+    Run one broker process per shard and wait for them to finish; the
+    shards are stopped when this process is sent SIGTERM
+    """
+    # Spawn rather than fork so each shard initialises its own tracer
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=run_shard, args=(url, i, shards, tail_latency, kwargs),
+                               name='broker-shard-%d' % i)
+               for i in range(shards)]
+
+    def stop(signum, frame):
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    except KeyboardInterrupt:
+        for w in workers:
+            w.join()
 
 
 def main():
     parser = optparse.OptionParser(usage="usage: %prog [options]")
     parser.add_option("-a", "--address", default="localhost:5672",
                       help="address router listens on (default %default)")
+    parser.add_option("-M", "--metrics", action="store_true", default=False,
+                      help="record queue residence histograms and only trace sampled messages")
+    parser.add_option("-i", "--stats-interval", type="float", default=10.0,
+                      help="seconds between queue statistics reports in metrics mode (default %default)")
+    parser.add_option("-d", "--spill-dir", default=None,
+                      help="directory to spill deep queues to (default: keep all messages in memory)")
+    parser.add_option("-l", "--memory-limit", type="int", default=10000,
+                      help="messages kept in memory per queue before spilling (default %default)")
+    parser.add_option("-s", "--shards", type="int", default=1,
+                      help="number of broker processes sharing the queues; shard n listens on the port after shard n-1 (default %default)")
+    parser.add_option("-r", "--raw", action="store_true", default=False,
+                      help="forward message bytes as received instead of decoding and re-encoding them")
+    parser.add_option("-p", "--metrics-port", type="int", default=None,
+                      help="serve Prometheus metrics on this port, counting up from it for each shard (default: none)")
+    parser.add_option("-c", "--credit", type="int", default=0,
+                      help="fixed credit window for incoming links; 0 sizes it to how fast messages are processed (default %default)")
+    parser.add_option("-T", "--transit", action="store_true", default=False,
+                      help="add queue and dequeue times to messages carrying transit timestamps")
+    parser.add_option("-L", "--tail-latency", type="float", default=None,
+                      help="only export traces with a span slower than this many seconds or a failed delivery (default: export all)")
     opts, args = parser.parse_args()
 
+    if opts.shards > 1:
+        run_sharded(opts.address, opts.shards, opts.tail_latency, metrics=opts.metrics,
+                    stats_interval=opts.stats_interval, spill_dir=opts.spill_dir, memory_limit=opts.memory_limit,
+                    metrics_port=opts.metrics_port, raw=opts.raw, credit=opts.credit, transit=opts.transit)
+        return
+
+    init_broker_tracer(opts.tail_latency)
     try:
-        Container(Broker(opts.address)).run()
+        Container(Broker(opts.address, opts.metrics, opts.stats_interval,
+                         opts.spill_dir, opts.memory_limit, opts.metrics_port, opts.raw, opts.credit,
+                         opts.transit)).run()
     except KeyboardInterrupt:
         pass
 
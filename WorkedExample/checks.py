@@ -0,0 +1,643 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+"""
+Self checks of the example broker and tracing.
+
+Each check runs in a fresh process, as tracing is set up once per process,
+and prints ok or what went wrong; the exit status is non-zero if any
+failed. Run them all, or name the ones to run. Checks that pass messages
+listen on the given address, counting up the port for each run.
+"""
+
+import collections
+import optparse
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import types
+
+from proton import Message
+from proton.handlers import MessagingHandler
+from proton.reactor import Container
+
+CHECKS = []
+
+
+def check(f):
+    CHECKS.append(f)
+    return f
+
+
+def brokered(url, count, metrics=False):
+    """
+    Send count messages through an example broker container in this thread
+    and receive them back
+
+    :return: the number of messages received
+    """
+    import benchmark
+    import broker
+
+    stats = benchmark.Stats()
+
+    class CheckBroker(broker.Broker):
+        def on_start(self, event):
+            super(CheckBroker, self).on_start(event)
+            self.client = benchmark.Client(count, stats, True, self.acceptor.close)
+            self.client.start(event.container, self.url, 'check')
+
+    Container(CheckBroker(url, metrics=metrics)).run()
+    return stats.count
+
+
+def traces(spans):
+    """
+    :return: {trace id: [span, ...]}
+    """
+    result = collections.defaultdict(list)
+    for span in spans:
+        result[span.trace_id].append(span)
+    return result
+
+
+def tag(span, key):
+    """
+    :return: the string value of a jaeger span's tag, or None
+    """
+    for t in span.tags:
+        if t.key == key:
+            return t.vStr
+    return None
+
+
+class StubConsumer(object):
+    """
+    Stands in for a consumer link of the broker, keeping what it is sent
+    """
+    def __init__(self, credit):
+        self.credit = credit
+        self.connection = object()
+        self.messages = []
+
+    def send(self, message):
+        self.credit -= 1
+        self.messages.append(message)
+
+
+@check
+def unsampled_decision_propagated(url):
+    """
+    Messages the producer does not sample are not sampled afresh by the
+    broker or the consumer, with or without broker metrics
+    """
+    import proton_tracing
+    from jaeger_client.reporter import InMemoryReporter
+
+    reporter = InMemoryReporter()
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ProbabilisticSampler(0.5), reporter=reporter)
+    count = 1000
+    for url, metrics in ((url, False), (next_url(url), True)):
+        del reporter.spans[:]
+        assert brokered(url, count, metrics) == count, 'messages lost'
+        by_trace = traces(reporter.get_spans())
+        roots = collections.Counter(s.operation_name for spans in by_trace.values() for s in spans
+                                    if s.parent_id is None)
+        assert list(roots) == ['amqp-delivery-send'], 'traces started at %s' % dict(roots)
+        # Send and receive at the producer, broker and consumer, and the queue spans
+        incomplete = [len(spans) for spans in by_trace.values() if len(spans) != 6]
+        assert not incomplete, '%d incomplete traces' % len(incomplete)
+        assert count * 0.3 < len(by_trace) < count * 0.7, '%d traces sampled' % len(by_trace)
+
+
+@check
+def unsampled_traces_kept_apart(url):
+    """
+    Each message not sampled carries a trace context of its own in every
+    encoding, and a span forced to be sampled while handling one stays in
+    that message's trace without marking later messages sampled
+    """
+    import proton_tracing
+    from proton_tracing import _encoding, _tracing
+    from jaeger_client.reporter import InMemoryReporter
+    from opentracing.ext import tags
+
+    reporter = InMemoryReporter()
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(False), reporter=reporter)
+    tracer = proton_tracing.get_tracer()
+    for encoding in _encoding.ENCODINGS:
+        ctx = _tracing._unsampled_context(tracer, tracer._random_id(64))
+        value = _encoding.inject(tracer, ctx, encoding)
+        extracted = _encoding.extract(tracer, value)
+        assert _encoding.trace_flags(value) == 0, '%s marked sampled' % encoding
+        assert (extracted.trace_id, extracted.span_id) == (ctx.trace_id, ctx.span_id), '%s ids lost' % encoding
+
+    count = 10
+
+    class Forcing(MessagingHandler):
+        def __init__(self):
+            super(Forcing, self).__init__()
+            self.sent = 0
+            self.received = []
+
+        def on_start(self, event):
+            self.acceptor = event.container.listen(url)
+            self.connection = event.container.connect(url)
+            event.container.create_sender(self.connection, 'check')
+            event.container.create_receiver(self.connection, 'check')
+
+        def on_sendable(self, event):
+            while event.sender.credit and self.sent < count:
+                self.sent += 1
+                event.sender.send(Message(body=self.sent))
+
+        def on_message(self, event):
+            active = tracer.active_span
+            self.received.append((active.context.trace_id, active.context.parent_id, active.context.flags))
+            if len(self.received) == 1:
+                active.set_tag(tags.SAMPLING_PRIORITY, 1)
+                tracer.start_span('forced').finish()
+            if len(self.received) == count:
+                self.connection.close()
+                self.acceptor.close()
+
+    handler = Forcing()
+    Container(handler).run()
+    trace_ids = set(trace_id for trace_id, _, _ in handler.received)
+    assert len(trace_ids) == count, '%d traces for %d messages' % (len(trace_ids), count)
+    assert all(parent_id for _, parent_id, _ in handler.received), 'receive not a child of the send'
+    assert not any(flags for _, _, flags in handler.received[1:]), 'later messages marked sampled'
+    forced = reporter.get_spans()
+    assert [(s.operation_name, s.trace_id) for s in forced] == [('forced', handler.received[0][0])], \
+        'reported %s' % [(s.operation_name, s.trace_id) for s in forced]
+
+
+@check
+def concurrent_containers_complete_traces(url):
+    """
+    Brokered flows on several containers at once, each on its own thread,
+    report every span of every message through a BatchReporter, and each
+    message's spans form one chain in their own trace
+    """
+    import proton_tracing
+
+    class KeepingReporter(proton_tracing.BatchReporter):
+        # Keeps the batches instead of sending them to an agent
+        def __init__(self):
+            super(KeepingReporter, self).__init__()
+            self.kept = []
+
+        def _send(self, spans):
+            self.kept.extend(spans)
+            self.sent += len(spans)
+
+    reporter = KeepingReporter()
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(True), reporter=reporter)
+    containers = 4
+    count = 500
+    received = [0] * containers
+
+    def flow(i):
+        received[i] = brokered(next_url(url, i), count)
+
+    threads = [threading.Thread(target=flow, args=(i,)) for i in range(containers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert received == [count] * containers, 'messages received %s' % received
+    assert proton_tracing.flush_tracer(10), 'spans not sent'
+    assert not reporter.dropped, '%d spans dropped' % reporter.dropped
+
+    by_trace = traces(reporter.kept)
+    assert len(by_trace) == containers * count, '%d traces' % len(by_trace)
+    operations = sorted(['amqp-delivery-send', 'amqp-delivery-receive', 'queue-message', 'dequeue-message'] +
+                        ['amqp-delivery-send', 'amqp-delivery-receive'])
+    for spans in by_trace.values():
+        assert sorted(s.operation_name for s in spans) == operations, \
+            'trace of %s' % [s.operation_name for s in spans]
+        ids = set(s.span_id for s in spans)
+        roots = [s for s in spans if s.parent_id is None]
+        assert len(roots) == 1 and roots[0].operation_name == 'amqp-delivery-send', 'trace not rooted at the send'
+        assert all(s.parent_id in ids for s in spans if s is not roots[0]), 'span parented outside its trace'
+
+
+@check
+def large_spans_fit_in_packets(url):
+    """
+    Batches of spans too large for one UDP packet are split into packets
+    that fit, and a span too large on its own is dropped and counted
+    """
+    import socket
+    import proton_tracing
+
+    agent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    agent.bind(('127.0.0.1', 0))
+    agent.settimeout(1)
+    reporter = proton_tracing.BatchReporter('127.0.0.1', agent.getsockname()[1])
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(True), reporter=reporter)
+    tracer = proton_tracing.get_tracer()
+    count = 50
+    # Log values are cut to 1024 bytes, so each span encodes to about 20k
+    for i in range(count + 1):
+        span = tracer.start_span('large')
+        for _ in range(100 if i == count else 20):
+            span.log_kv({'event': 'x' * 1000})
+        span.finish()
+    assert proton_tracing.flush_tracer(5), 'spans not sent'
+    sizes = []
+    try:
+        while True:
+            sizes.append(len(agent.recv(1 << 17)))
+    except socket.timeout:
+        pass
+    assert (reporter.sent, reporter.failed, reporter.too_large) == (count, 0, 1), \
+        'sent %d, failed %d, too large %d' % (reporter.sent, reporter.failed, reporter.too_large)
+    assert sizes and max(sizes) <= reporter.max_packet_size, 'packets of %s bytes' % sizes
+
+
+@check
+def quiet_delivery_spans_time_out(url):
+    """
+    Spans of deliveries left unsettled are finished as timed out after the
+    delivery timeout, with nothing more sent on the connection
+    """
+    import proton_tracing
+    from jaeger_client.reporter import InMemoryReporter
+
+    reporter = InMemoryReporter()
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(True), reporter=reporter,
+                               delivery_timeout=0.5)
+    count = 5
+
+    class Unsettled(MessagingHandler):
+        def __init__(self):
+            super(Unsettled, self).__init__(auto_accept=False)
+            self.sent = 0
+            self.states = None
+
+        def on_start(self, event):
+            self.acceptor = event.container.listen(url)
+            self.connection = event.container.connect(url)
+            event.container.create_sender(self.connection, 'check')
+            event.container.schedule(1.5, self)
+
+        def on_sendable(self, event):
+            while event.sender.credit and self.sent < count:
+                self.sent += 1
+                event.sender.send(Message(body=self.sent))
+
+        def on_timer_task(self, event):
+            self.states = collections.Counter(tag(s, 'delivery-terminal-state') for s in reporter.get_spans()
+                                              if s.operation_name == 'amqp-delivery-send')
+            self.connection.close()
+            self.acceptor.close()
+
+    handler = Unsettled()
+    Container(handler).run()
+    assert handler.states == {'TIMED_OUT': count}, 'send spans by state %s' % dict(handler.states)
+
+
+@check
+def aborted_deliveries_finished(url):
+    """
+    Spans of deliveries aborted by the sender, alone or in a batch, are
+    finished as aborted, with no timer left to hold up the container
+    """
+    import proton_tracing
+    from jaeger_client.reporter import InMemoryReporter
+
+    reporter = InMemoryReporter()
+    policies = proton_tracing.PolicyTable([('batched', proton_tracing.TracePolicy(batch=0.1))])
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(True), reporter=reporter,
+                               policies=policies)
+
+    class Aborting(MessagingHandler):
+        def __init__(self):
+            super(Aborting, self).__init__()
+            self.aborted = set()
+
+        def on_start(self, event):
+            self.acceptor = event.container.listen(url)
+            self.connection = event.container.connect(url)
+            event.container.create_sender(self.connection, 'single')
+            event.container.create_sender(self.connection, 'batched')
+            event.container.schedule(0.5, self)
+
+        def on_sendable(self, event):
+            address = event.sender.target.address
+            if address not in self.aborted:
+                self.aborted.add(address)
+                event.sender.send(Message(body=address)).abort()
+
+        def on_timer_task(self, event):
+            self.connection.close()
+            self.acceptor.close()
+
+    start = time.monotonic()
+    Container(Aborting()).run()
+    assert time.monotonic() - start < 2, 'container held up'
+    spans = dict((s.operation_name, s) for s in reporter.get_spans() if s.operation_name.startswith('amqp-delivery-send'))
+    state = tag(spans['amqp-delivery-send'], 'delivery-terminal-state')
+    assert state == 'ABORTED', 'send span %s' % state
+    outcomes = [t.key for t in spans['amqp-delivery-send-batch'].tags if t.key.startswith('delivery-outcome.')]
+    assert outcomes == ['delivery-outcome.ABORTED'], 'batch span outcomes %s' % outcomes
+
+
+@check
+def tail_sampling_keeps_failed_batches(url):
+    """
+    Tail sampling keeps the traces of send batches with deliveries rejected
+    or released, as it does single deliveries
+    """
+    import proton_tracing
+    from jaeger_client.reporter import InMemoryReporter
+
+    kept = InMemoryReporter()
+    proton_tracing.init_tracer('checks', sampler=proton_tracing.ConstSampler(True),
+                               reporter=proton_tracing.TailSamplingReporter(kept, baseline=0))
+    tracer = proton_tracing.get_tracer()
+    for outcomes in ({'ACCEPTED': 10}, {'ACCEPTED': 9, 'REJECTED': 1}, {'PRESETTLED': 5, 'RELEASED': 5}):
+        span = tracer.start_span('amqp-delivery-send-batch', tags={'outcomes': str(sorted(outcomes))})
+        for state, count in outcomes.items():
+            span.set_tag('delivery-outcome.%s' % state, count)
+        span.finish()
+    assert [tag(s, 'outcomes') for s in kept.get_spans()] == ["['ACCEPTED', 'REJECTED']", "['PRESETTLED', 'RELEASED']"], \
+        'kept %s' % [tag(s, 'outcomes') for s in kept.get_spans()]
+
+
+@check
+def producers_resume_when_consumers_leave(url):
+    """
+    A producer held back by the messages waiting for a queue's consumers
+    sends the rest when the last consumer detaches
+    """
+    import broker
+
+    count = 2000
+    taken = 10
+
+    class Consumer(MessagingHandler):
+        def __init__(self, on_attached):
+            super(Consumer, self).__init__(prefetch=0)
+            self.on_attached = on_attached
+            self.received = 0
+
+        def on_link_opened(self, event):
+            event.receiver.flow(taken)
+            self.on_attached()
+
+        def on_message(self, event):
+            self.received += 1
+            if self.received == taken:
+                # Stays long enough for the producer to be held back
+                self.receiver = event.receiver
+                event.container.schedule(0.5, self)
+
+        def on_timer_task(self, event):
+            self.receiver.close()
+
+    class Producer(MessagingHandler):
+        def __init__(self, done):
+            super(Producer, self).__init__()
+            self.done = done
+            self.sent = 0
+            self.accepted = 0
+
+        def on_sendable(self, event):
+            while event.sender.credit and self.sent < count:
+                self.sent += 1
+                event.sender.send(Message(body=self.sent))
+
+        def on_accepted(self, event):
+            self.accepted += 1
+            if self.accepted == count:
+                self.done()
+
+    class CheckBroker(broker.Broker):
+        def on_start(self, event):
+            super(CheckBroker, self).on_start(event)
+            self.container = event.container
+            self.consumer = Consumer(self.start_producer)
+            self.connection = event.container.connect(self.url)
+            event.container.create_receiver(self.connection, 'check', handler=self.consumer)
+            self.producer = Producer(self.stop)
+            # Gives up if the producer stalls
+            self.timeout = event.container.schedule(10, self)
+
+        def start_producer(self):
+            self.container.create_sender(self.connection, 'check', handler=self.producer)
+
+        def on_timer_task(self, event):
+            self.stop()
+
+        def stop(self):
+            self.timeout.cancel()
+            self.connection.close()
+            self.acceptor.close()
+
+    b = CheckBroker(url)
+    Container(b).run()
+    assert b.consumer.received == taken, '%d messages received' % b.consumer.received
+    assert b.producer.accepted == count, 'producer stalled after %d messages' % b.producer.accepted
+
+
+@check
+def sharded_clients_follow_redirects(url):
+    """
+    Clients attaching through one shard of a sharded broker to an address
+    another shard owns are redirected there, and the messages sent get
+    through
+    """
+    import broker
+    from client_common import follow_redirect
+
+    shards = 2
+    count = 200
+    address = next(a for a in ('check-%d' % i for i in range(100)) if broker.shard_for(a, shards) == 1)
+    done = threading.Event()
+
+    class Shard(broker.ShardedBroker):
+        def on_start(self, event):
+            super(Shard, self).on_start(event)
+            event.container.schedule(0.1, self)
+
+        def on_timer_task(self, event):
+            if done.is_set():
+                self.acceptor.close()
+            else:
+                event.container.schedule(0.1, self)
+
+    threads = [threading.Thread(target=Container(Shard(url, i, shards)).run) for i in range(shards)]
+    for t in threads:
+        t.start()
+
+    class Clients(MessagingHandler):
+        def __init__(self):
+            super(Clients, self).__init__()
+            self.sent = 0
+            self.received = 0
+            self.redirected = 0
+            self.connections = []
+
+        def on_start(self, event):
+            event.container.create_receiver('%s/%s' % (url, address))
+            event.container.create_sender('%s/%s' % (url, address))
+            self.timeout = event.container.schedule(10, self)
+
+        def on_connection_opened(self, event):
+            self.connections.append(event.connection)
+
+        def on_link_error(self, event):
+            if follow_redirect(event) is None:
+                super(Clients, self).on_link_error(event)
+            else:
+                self.redirected += 1
+
+        def on_sendable(self, event):
+            while event.sender.credit and self.sent < count:
+                self.sent += 1
+                event.sender.send(Message(body=self.sent))
+
+        def on_message(self, event):
+            self.received += 1
+            if self.received == count:
+                self.stop()
+
+        def on_timer_task(self, event):
+            self.stop()
+
+        def stop(self):
+            self.timeout.cancel()
+            for connection in self.connections:
+                connection.close()
+
+    clients = Clients()
+    try:
+        Container(clients).run()
+    finally:
+        done.set()
+        for t in threads:
+            t.join()
+    assert clients.redirected == 2, '%d links redirected' % clients.redirected
+    assert clients.received == count, '%d of %d messages received' % (clients.received, count)
+
+
+@check
+def expiry_after_queue_deleted(url):
+    """
+    A message dispatched before its time to live passes, on a queue deleted
+    when its consumer detaches, is ignored when its expiry comes round
+    """
+    import broker
+
+    b = broker.Broker('localhost:0')
+    consumer = StubConsumer(1)
+    q = b._queue('expiry-check')
+    b._subscribe(consumer, 'expiry-check', q)
+    q.publish(Message(body='dispatched', ttl=0.05))
+    assert len(consumer.messages) == 1, 'message not dispatched'
+    for link, (address, queue) in b.consumers.remove_connection(consumer.connection):
+        b._unsubscribe(link, address, queue)
+    assert 'expiry-check' not in b.queues, 'queue not deleted'
+    assert b.expiry.wheel.pending == 1
+
+    # A message still queued when its time passes is dropped
+    waiting = b._queue('expiry-check-waiting')
+    waiting.publish(Message(body='expired', ttl=0.05))
+
+    time.sleep(b.expiry.wheel.tick + 0.1)
+    b.expiry.on_timer_task(types.SimpleNamespace(container=None))
+    assert b.expiry.wheel.pending == 0
+    assert q.expired == 0, 'dispatched message expired'
+    assert waiting.expired == 1 and waiting.depth() == 0, 'queued message not expired'
+
+
+@check
+def queue_metrics_per_broker(url):
+    """
+    The queue metrics cover the queues of every broker in the process,
+    labelled with the broker
+    """
+    import broker
+    import proton_tracing
+
+    first = broker.Broker(url)
+    second = broker.Broker(next_url(url))
+    first._queue('metrics-check').publish(Message(body='first'))
+    second._queue('metrics-check')
+    depths = [line for line in proton_tracing.metrics.collect().splitlines()
+              if line.startswith('broker_queue_depth{')]
+    assert depths == ['broker_queue_depth{broker="%s",address="metrics-check"} 1' % first.url,
+                      'broker_queue_depth{broker="%s",address="metrics-check"} 0' % second.url], \
+        'queue depths %s' % depths
+
+
+def next_url(url, n=1):
+    host, port = url.rsplit(':', 1)
+    return '%s:%d' % (host, int(port) + n)
+
+
+def run(name, url):
+    # In the child process
+    try:
+        dict((f.__name__, f) for f in CHECKS)[name](url)
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options] [CHECK...]",
+                                   description="Run self checks of the example broker and tracing.")
+    parser.add_option("-l", "--list", action="store_true", default=False,
+                      help="list the checks and exit")
+    parser.add_option("-a", "--address", default="localhost:5689",
+                      help="address checks passing messages listen on, counting up the ports (default %default)")
+    parser.add_option("--child", action="store_true", default=False,
+                      help=optparse.SUPPRESS_HELP)
+    opts, args = parser.parse_args()
+    if opts.child:
+        run(args[0], opts.address)
+        return
+    checks = dict((f.__name__, f) for f in CHECKS)
+    if opts.list:
+        for f in CHECKS:
+            print('%s: %s' % (f.__name__, ' '.join(f.__doc__.split())))
+        return
+    unknown = [name for name in args if name not in checks]
+    if unknown:
+        parser.error('unknown check %s' % ', '.join(unknown))
+
+    failed = 0
+    for i, name in enumerate(args or [f.__name__ for f in CHECKS]):
+        # Each check gets a few ports to itself
+        status = subprocess.call([sys.executable, __file__, '--child', '-a', next_url(opts.address, i * 10), name])
+        if status:
+            failed += 1
+        print('%s: %s' % (name, 'FAILED' if status else 'ok'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
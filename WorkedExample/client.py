@@ -24,9 +24,8 @@ from client_common import Client
 
 from proton.reactor import Container
 
-from proton.tracing import init_tracer
-
-tracer = init_tracer('client')
+import proton_tracing
+from proton_tracing import init_tracer
 
 REQUESTS= ["Twas brillig, and the slithy toves",
            "Did gire and gymble in the wabe.",
@@ -37,9 +36,30 @@ parser = optparse.OptionParser(usage="usage: %prog [options]",
                                description="Send requests to the supplied address and print responses.")
 parser.add_option("-a", "--address", default="localhost:5672/examples",
                   help="address to which messages are sent (default %default)")
+parser.add_option("-w", "--window", type="int", default=None,
+                  help="maximum number of requests outstanding at once (default: sender credit)")
+parser.add_option("-t", "--timeout", type="float", default=None,
+                  help="seconds to wait for each reply (default: forever)")
+parser.add_option("-n", "--repeat", type="int", default=1,
+                  help="number of times to send the requests (default %default)")
+parser.add_option("-q", "--quiet", action="store_true", default=False,
+                  help="don't print the replies")
+parser.add_option("-T", "--tail-latency", type="float", default=None,
+                  help="only export traces with a span slower than this many seconds or a failed delivery (default: export all)")
 opts, args = parser.parse_args()
 
+if opts.tail_latency is not None and proton_tracing.enabled():
+    tracer = init_tracer('client', sampler=proton_tracing.ConstSampler(True),
+                         reporter=proton_tracing.TailSamplingReporter(latency_threshold=opts.tail_latency))
+else:
+    tracer = init_tracer('client')
+
+requests = (args or REQUESTS) * opts.repeat
+
 with tracer.start_active_span('client-requests') as context:
     # Force trace for this operation
     context.span.set_tag(tags.SAMPLING_PRIORITY, 1)
-    Container(Client(opts.address, args or REQUESTS, tracer)).run()
+    client = Client(opts.address, requests, tracer, opts.window, opts.timeout, opts.quiet)
+    Container(client).run()
+    if client.timed_out:
+        print("%d requests timed out" % client.timed_out)
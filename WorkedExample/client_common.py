@@ -17,57 +17,271 @@
 # under the License.
 #
 
+import asyncio
+import collections
+import threading
+import time
 import uuid
 
-from proton import Message
+from proton import Endpoint, Message, symbol
 from proton.handlers import MessagingHandler
+from proton.reactor import ApplicationEvent, Container, EventInjector
+
+
+def follow_redirect(event):
+    """
+    Reopen a link the peer closed with an ``amqp:link:redirect`` error, as
+    the shards of ``broker.py -s`` do for addresses another shard owns, on a
+    new connection to the host and port the error names. The old connection
+    is closed unless other links still use it.
+
+    :return: the new link, or None if the error was not a redirect
+    """
+    link = event.link
+    condition = link.remote_condition
+    if condition is None or condition.name != 'amqp:link:redirect':
+        return None
+    info = condition.info or {}
+    host = info.get(symbol('network-host'))
+    port = info.get(symbol('port'))
+    if host is None or port is None:
+        return None
+    address = info.get(symbol('address'))
+    if address is None:
+        address = link.remote_source.address if link.is_sender else link.remote_target.address
+    old = link.connection
+    connection = event.container.connect('%s:%d' % (host, port))
+    if link.is_sender:
+        new = event.container.create_sender(connection, address)
+    else:
+        new = event.container.create_receiver(connection, address)
+    others = old.link_head(Endpoint.LOCAL_ACTIVE)
+    while others is not None and others == link:
+        others = others.next(Endpoint.LOCAL_ACTIVE)
+    if others is None:
+        old.close()
+    return new
 
 
 class Client(MessagingHandler):
-    def __init__(self, url, requests, tracer):
+    """
+    Request/response client over a sender and a dynamic reply receiver.
+
+    Requests are queued without any tracing work; each gets its id and span
+    when it is actually sent. At most ``window`` requests (and never more
+    than the sender has credit for) are outstanding at once, and if
+    ``timeout`` is set a request with no reply after that many seconds has
+    its span finished with a timeout tag and is forgotten.
+    """
+    def __init__(self, url, requests, tracer, window=None, timeout=None, quiet=False):
         super(Client, self).__init__()
         self.url = url
-        self.requests_queued = []
+        self.requests_queued = collections.deque()
         self.requests_outstanding = {}
         self.tracer = tracer
+        self.window = window
+        self.timeout = timeout
+        self.quiet = quiet
+        self.timed_out = 0
+        self.timer = None
         for r in requests:
             self.add_request(r)
 
     def add_request(self, r):
-        tags = { 'request': r}
-        span = self.tracer.start_span('request', tags=tags)
-        id = uuid.uuid4()
-        self.requests_queued.append( (id, r, span) )
+        self.requests_queued.append(r)
 
     def pop_request(self, id):
-        return self.requests_outstanding.pop(id)
+        return self.requests_outstanding.pop(id, None)
 
     def on_start(self, event):
+        self.container = event.container
         self.sender = event.container.create_sender(self.url)
         self.receiver = event.container.create_receiver(self.sender.connection, None, dynamic=True)
 
+    def can_send(self):
+        return (self.requests_queued and self.sender.credit and self.receiver.remote_source.address and
+                (self.window is None or len(self.requests_outstanding) < self.window))
+
     def next_request(self):
-        if self.receiver.remote_source.address:
-            (id, req, span) = self.requests_queued.pop(0)
-            with self.tracer.scope_manager.activate(span, False):
-                span.log_kv({'event': 'request-sent'})
-                msg = Message(reply_to=self.receiver.remote_source.address, correlation_id=id, body=req)
-                self.sender.send(msg)
-                self.requests_outstanding[id] = (req, span)
+        req = self.requests_queued.popleft()
+        span = self.tracer.start_span('request', tags={'request': req})
+        id = uuid.uuid4()
+        with self.tracer.scope_manager.activate(span, False):
+            span.log_kv({'event': 'request-sent'})
+            msg = Message(reply_to=self.receiver.remote_source.address, correlation_id=id, body=req)
+            self.sender.send(msg)
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        self.requests_outstanding[id] = (req, span, deadline)
+        if deadline is not None and self.timer is None:
+            self.timer = self.container.schedule(self.timeout, self)
+
+    def send_requests(self):
+        while self.can_send():
+            self.next_request()
 
     def on_link_opened(self, event):
         if event.receiver == self.receiver:
-            while len(self.requests_queued) > 0:
-                self.next_request()
+            self.send_requests()
+
+    def on_link_error(self, event):
+        sender = follow_redirect(event)
+        if sender is None:
+            super(Client, self).on_link_error(event)
+        else:
+            # Replies still come back to the receiver on the first connection
+            self.sender = sender
+
+    def on_sendable(self, event):
+        self.send_requests()
+
+    def on_timer_task(self, event):
+        self.timer = None
+        now = time.monotonic()
+        # Requests are sent with the same timeout, so the earliest deadlines come first
+        while self.requests_outstanding:
+            id, (req, span, deadline) = next(iter(self.requests_outstanding.items()))
+            if deadline > now:
+                self.timer = self.container.schedule(deadline - now, self)
+                break
+            del self.requests_outstanding[id]
+            span.set_tag('timeout', True)
+            span.log_kv({'event': 'request-timed-out'})
+            span.finish()
+            self.timed_out += 1
+            if not self.quiet:
+                print("%s => timed out" % req)
+        self.send_requests()
+        self.check_done()
 
     def on_message(self, event):
         id = event.message.correlation_id
         reply = event.message.body
-        (req, span) = self.pop_request(id)
+        entry = self.pop_request(id)
+        if entry is None:
+            # Reply to a request that has already timed out
+            return
+        (req, span, deadline) = entry
         span.log_kv({'event': 'reply-received', 'result': reply})
         span.finish()
-        print("%s => %s" % (req, reply))
-        if self.requests_queued:
-            self.next_request()
-        elif len(self.requests_outstanding) == 0:
-            event.connection.close()
+        if not self.quiet:
+            print("%s => %s" % (req, reply))
+        self.send_requests()
+        self.check_done()
+
+    def check_done(self):
+        if not self.requests_queued and not self.requests_outstanding:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.sender.connection.close()
+            self.receiver.connection.close()
+
+
+def _resolve(future, result):
+    # The caller may have given up on the reply already
+    if not future.done():
+        future.set_result(result)
+
+
+def _fail(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class AsyncClient(MessagingHandler):
+    """
+    asyncio request/response client; the container runs on its own thread.
+
+    ``await client.call(address, body)`` sends the request over an anonymous
+    sender with a fresh correlation id and the shared dynamic reply address,
+    and returns the reply body. Each call's 'request' span is a child of the
+    span active in the calling task, so for concurrent calls to be parented
+    correctly the tracer needs a ``ContextVarsScopeManager``. Everything that
+    touches proton is handed to the container thread through an injector.
+    """
+    def __init__(self, url, tracer, prefetch=1000):
+        super(AsyncClient, self).__init__(prefetch=prefetch)
+        self.url = url
+        self.tracer = tracer
+        self.requests_outstanding = {}
+        self.reply_to = None
+        self.container = Container(self)
+        self.injector = EventInjector()
+        self.container.selectable(self.injector)
+        self.thread = threading.Thread(target=self.container.run, daemon=True)
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.ready = self.loop.create_future()
+        self.thread.start()
+        await self.ready
+
+    async def close(self):
+        self.injector.trigger(ApplicationEvent('close'))
+        await self.loop.run_in_executor(None, self.thread.join)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def call(self, address, body, timeout=None):
+        """
+        :return: the reply body
+        :raise asyncio.TimeoutError: if there is no reply within timeout seconds
+        """
+        span = self.tracer.start_span('request', tags={'request': body})
+        id = uuid.uuid4()
+        future = self.loop.create_future()
+        self.injector.trigger(ApplicationEvent('call', subject=(id, address, body, span, future)))
+        try:
+            reply = await asyncio.wait_for(future, timeout)
+            span.log_kv({'event': 'reply-received', 'result': reply})
+        except asyncio.TimeoutError:
+            span.set_tag('timeout', True)
+            span.log_kv({'event': 'request-timed-out'})
+            self.injector.trigger(ApplicationEvent('forget', subject=id))
+            raise
+        except asyncio.CancelledError:
+            self.injector.trigger(ApplicationEvent('forget', subject=id))
+            raise
+        finally:
+            span.finish()
+        return reply
+
+    # Everything below runs on the container thread
+
+    def on_start(self, event):
+        self.conn = event.container.connect(self.url)
+        self.sender = event.container.create_sender(self.conn, None)
+        self.receiver = event.container.create_receiver(self.conn, None, dynamic=True)
+
+    def on_link_opened(self, event):
+        if event.receiver == self.receiver:
+            self.reply_to = self.receiver.remote_source.address
+            self.loop.call_soon_threadsafe(_resolve, self.ready, None)
+
+    def on_call(self, event):
+        id, address, body, span, future = event.subject
+        self.requests_outstanding[id] = future
+        with self.tracer.scope_manager.activate(span, False):
+            span.log_kv({'event': 'request-sent'})
+            msg = Message(address=address, reply_to=self.reply_to, correlation_id=id, body=body)
+            self.sender.send(msg)
+
+    def on_forget(self, event):
+        self.requests_outstanding.pop(event.subject, None)
+
+    def on_message(self, event):
+        future = self.requests_outstanding.pop(event.message.correlation_id, None)
+        if future is not None:
+            self.loop.call_soon_threadsafe(_resolve, future, event.message.body)
+
+    def on_close(self, event):
+        for future in self.requests_outstanding.values():
+            self.loop.call_soon_threadsafe(_fail, future, ConnectionError('client closed'))
+        self.requests_outstanding.clear()
+        self.conn.close()
+        self.injector.close()
@@ -23,7 +23,7 @@ import optparse
 from proton.handlers import MessagingHandler
 from proton.reactor import Container
 
-import proton.tracing
+import proton_tracing
 
 
 class Recv(MessagingHandler):
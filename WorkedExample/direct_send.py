@@ -24,7 +24,7 @@ from proton import Message
 from proton.handlers import MessagingHandler
 from proton.reactor import Container
 
-import proton.tracing
+import proton_tracing
 
 
 class Send(MessagingHandler):
@@ -0,0 +1,232 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import math
+import time
+
+from proton import Endpoint, Handler
+
+
+class _LinkFlow(object):
+    __slots__ = ('window', 'rtt', 'rtt_min', 'issued', 'received', 'probe', 'probed', 'probed_busy',
+                 'busy', 'began', 'start', 'start_busy', 'processed', 'rate')
+
+    def __init__(self, window):
+        self.window = window
+        # Round trip estimate and the smallest sample this interval
+        self.rtt = None
+        self.rtt_min = None
+        # Credit granted and messages received over the link's life; the
+        # probe is the message that will use the credit granted at probed
+        self.issued = 0
+        self.received = 0
+        self.probe = None
+        self.probed = None
+        self.probed_busy = 0.0
+        # Seconds spent processing the link's messages
+        self.busy = 0.0
+        self.began = None
+        self.start = None
+        self.start_busy = 0.0
+        self.processed = 0
+        self.rate = 0.0
+
+
+class _ProcessingTimer(Handler):
+    """
+    Runs after the other child handlers, once a message has been processed
+    """
+    def on_delivery(self, event):
+        state = getattr(event.link, 'adaptive_flow', None)
+        if state is not None and state.began is not None:
+            state.busy += time.monotonic() - state.began
+            state.began = None
+
+
+class AdaptiveFlowController(Handler):
+    """
+    Flow controller sizing each receiving link's credit from the rate its
+    messages are processed and the time credit takes to come back as a
+    message, in place of :class:`proton.handlers.FlowController`'s fixed
+    window. Add it to a ``MessagingHandler(prefetch=0)`` with :meth:`install`.
+
+    Every ``interval`` seconds of traffic a link's window is set to
+    ``headroom`` times the messages it could process in a round trip, within
+    ``minimum`` and ``maximum``. The processing rate is messages per second
+    spent processing them, so it is what the link can take rather than what
+    it is being sent; with ``backlog`` it is messages got through per second.
+
+    The round trip is timed from granting credit to a sender that has used
+    all it had to the arrival of the message that uses it, less the time
+    spent processing messages meanwhile, so a slow consumer does not mistake
+    its own backlog for a long round trip. Lower samples are followed at
+    once and higher ones slowly. While the sender never runs out of credit
+    there are no samples and the estimate decays by ``decay`` each interval,
+    so a window larger than needed shrinks until it is measured again.
+
+    Messages received but not yet processed count against the window as
+    proton does not return their credit until they are, so in flight
+    messages never exceed what the link can work through.
+
+    :param backlog: optional function of a link returning how many of its
+        messages are still being processed elsewhere (on a worker pool for
+        example); these count against its window too. Call
+        :meth:`replenish` when they complete.
+    :param registry: optional :class:`proton_tracing.Metrics` to publish the
+        total window, processing rate, credit granted and round trip times
+        to, under names starting with ``name``
+    """
+    def __init__(self, initial=10, minimum=1, maximum=1000, headroom=2.0, interval=0.1, decay=0.9,
+                 backlog=None, registry=None, name='flow_control'):
+        self.initial = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.headroom = headroom
+        self.interval = interval
+        self.decay = decay
+        self.backlog = backlog
+        self.links = set()
+        self.granted = None
+        self.round_trip = None
+        if registry is not None:
+            self.granted = registry.counter(name + '_credit_granted_total', 'Credit granted to senders')
+            self.round_trip = registry.histogram(name + '_round_trip_seconds',
+                                                 'Time from granting credit to the message using it arriving')
+            registry.gauge(name + '_links', 'Receiving links with adaptive credit', lambda: len(self.links))
+            registry.gauge(name + '_credit_window', 'Sum of the links\' credit windows',
+                           lambda: sum(s.window for s in list(self.links)))
+            registry.gauge(name + '_processing_rate', 'Messages processed per second over all links',
+                           lambda: sum(s.rate for s in list(self.links)))
+
+    def install(self, handler):
+        """
+        Add the controller to a :class:`MessagingHandler`'s child handlers,
+        first so it sees each message before it is processed and with a
+        timer last to see when processing is done
+        """
+        handler.handlers.insert(0, self)
+        handler.handlers.append(_ProcessingTimer())
+        return self
+
+    def _state(self, link):
+        state = getattr(link, 'adaptive_flow', None)
+        if state is None:
+            state = link.adaptive_flow = _LinkFlow(self.initial)
+            self.links.add(state)
+        return state
+
+    def on_link_local_open(self, event):
+        if event.link.is_receiver:
+            self._flow(event.link, self._state(event.link))
+
+    def on_link_remote_open(self, event):
+        if event.link.is_receiver:
+            self._flow(event.link, self._state(event.link))
+
+    def on_link_flow(self, event):
+        if event.link.is_receiver:
+            self._flow(event.link, self._state(event.link))
+
+    def on_link_final(self, event):
+        state = getattr(event.link, 'adaptive_flow', None)
+        if state is not None:
+            self.links.discard(state)
+
+    def on_delivery(self, event):
+        link = event.link
+        if not link.is_receiver:
+            return
+        state = self._state(link)
+        now = time.monotonic()
+        state.began = now
+        if not event.delivery.partial:
+            state.received += 1
+            if state.probe is not None and state.received >= state.probe:
+                rtt = now - state.probed - (state.busy - state.probed_busy)
+                if state.rtt_min is None or rtt < state.rtt_min:
+                    state.rtt_min = rtt
+                if self.round_trip is not None:
+                    self.round_trip.record(rtt)
+                state.probe = None
+            if state.start is None:
+                state.start = now
+                state.start_busy = state.busy
+                state.processed = 0
+            else:
+                state.processed += 1
+                elapsed = now - state.start
+                if elapsed >= self.interval:
+                    self._resize(state, self._rate(state, elapsed))
+        # The message is about to be consumed, giving back its credit
+        dlv = event.delivery
+        self._flow(link, state, now, 1 if dlv.readable and not dlv.partial else 0)
+
+    def _rate(self, state, elapsed):
+        busy = state.busy - state.start_busy
+        if self.backlog is not None or busy <= 0:
+            # Processed elsewhere, so the rate they are got through
+            return state.processed / elapsed
+        return state.processed / busy
+
+    def _resize(self, state, rate):
+        state.rate = rate
+        state.start = None
+        if state.rtt_min is not None:
+            # A larger window adds its own queueing to the round trip
+            if state.rtt is None or state.rtt_min < state.rtt:
+                state.rtt = state.rtt_min
+            else:
+                state.rtt += (state.rtt_min - state.rtt) / 8
+            state.rtt_min = None
+        elif state.rtt is not None:
+            state.rtt *= self.decay
+        if state.rtt is not None:
+            # Plus one for the message being processed, as the credit
+            # granted for the next only goes out once it is done
+            window = rate * state.rtt * self.headroom + 1
+            state.window = max(self.minimum, min(int(math.ceil(window)), self.maximum))
+
+    def replenish(self, link):
+        """
+        Top up the link's credit once messages counted by ``backlog`` have
+        been processed
+        """
+        if link.state & Endpoint.LOCAL_ACTIVE:
+            self._flow(link, self._state(link), time.monotonic())
+
+    def _flow(self, link, state, now=None, consumed=0):
+        # A receiver's credit still counts messages received until they are
+        # processed, so it is all they have in flight
+        outstanding = link.credit - consumed
+        if self.backlog is not None:
+            outstanding += self.backlog(link)
+        delta = state.window - outstanding
+        if delta <= 0:
+            return
+        # Only timed when the sender has used all its credit, so that it can
+        # send as soon as this arrives, and not on open, where the time
+        # includes the peer starting to send
+        if now is not None and state.probe is None and link.credit == link.queued:
+            state.probe = state.issued + 1
+            state.probed = now
+            state.probed_busy = state.busy
+        state.issued += delta
+        link.flow(delta)
+        if self.granted is not None:
+            self.granted.inc(delta)
@@ -17,8 +17,128 @@
 # under the License.
 #
 
+
+"""
+Tracing of proton messages.
+
+Tracing is enabled on import unless the ``PROTON_TRACING`` environment
+variable is set to ``0``, ``false``, ``no`` or ``off``, and can be switched
+with :func:`enable` and :func:`disable` before any links are created. While
+disabled proton's own classes stay in place, jaeger is never imported and
+:func:`init_tracer` and :func:`get_tracer` return the opentracing no-op tracer.
+
+Modules that trace but leave it to the program running them to initialise
+tracing use :data:`tracer`, which stands in for the tracer and creates it
+on first use.
+"""
+
 from __future__ import absolute_import
 
-from ._tracing import (
-    get_tracer, init_tracer
-)
\ No newline at end of file
+import os
+import sys
+
+from ._histogram import Histogram
+from ._metrics import Metrics, metrics, serve_metrics
+from ._transit import TRANSIT_KEY, TransitLatency, stamp_sent, stamp_transit
+
+_enabled = os.environ.get('PROTON_TRACING', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# Loaded on first use as they need jaeger or opentracing
+_lazy = {
+    'BatchReporter': '._reporter',
+    'FileReporter': '._file',
+    'PolicyTable': '._policy',
+    'TracePolicy': '._policy',
+    'AddressSampler': '._sampling',
+    'ConstSampler': '._sampling',
+    'ProbabilisticSampler': '._sampling',
+    'RateLimitingSampler': '._sampling',
+    'ReactorScopeManager': '._scope',
+    'TailSamplingReporter': '._tail',
+}
+
+
+def __getattr__(name):
+    if name in _lazy:
+        import importlib
+        return getattr(importlib.import_module(_lazy[name], __name__), name)
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    from . import _tracing
+    _tracing.install()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    _tracing = sys.modules.get(__name__ + '._tracing')
+    if _tracing is not None:
+        _tracing.uninstall()
+
+
+def _noop_tracer():
+    import opentracing
+    return opentracing.global_tracer()
+
+
+def init_tracer(service_name, **kwargs):
+    if not _enabled:
+        return _noop_tracer()
+    from ._tracing import init_tracer
+    return init_tracer(service_name, **kwargs)
+
+
+def get_tracer():
+    if not _enabled:
+        return _noop_tracer()
+    from ._tracing import get_tracer
+    return get_tracer()
+
+
+class _Tracer(object):
+    # Looked up on every use, as tracing may be initialised, enabled or
+    # disabled after a module takes it
+    def __getattr__(self, name):
+        return getattr(get_tracer(), name)
+
+
+tracer = _Tracer()
+
+
+def is_sampled(span):
+    """
+    :return: True if span (which may be None) belongs to a sampled trace;
+        never for the spans of the no-op tracer used when tracing is disabled
+    """
+    # jaeger's SAMPLED_FLAG, without loading jaeger
+    return span is not None and bool(getattr(span.context, 'flags', 0) & 1)
+
+
+def transit_latency():
+    """
+    :return: the :class:`TransitLatency` of the messages received, or None
+        unless tracing was initialised with ``init_tracer(transit=True)``
+    """
+    _tracing = sys.modules.get(__name__ + '._tracing')
+    if _tracing is None:
+        return None
+    return _tracing._transit
+
+
+def flush_tracer(timeout=None):
+    _tracing = sys.modules.get(__name__ + '._tracing')
+    if _tracing is None:
+        return True
+    return _tracing.flush_tracer(timeout)
+
+
+if _enabled:
+    enable()
@@ -0,0 +1,98 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import collections
+import time
+
+
+class SendBatch(object):
+    """
+    The deliveries sent on a link in one time slice, sharing one span.
+
+    Every message in the batch carries the batch span's context, so
+    receivers still link to it. The slice ends ``interval`` seconds after
+    the first delivery (the batch is also a timer task that ends it then),
+    and the span is finished once every delivery in it has settled, tagged
+    with the delivery and byte counts, the first and last delivery tags and
+    how many deliveries reached each outcome.
+    """
+    def __init__(self, span, headers, interval, pending):
+        self.span = span
+        self.headers = headers
+        self.deadline = time.monotonic() + interval
+        self.closed = False
+        self.count = 0
+        self.bytes = 0
+        self.first_tag = None
+        self.last_tag = None
+        self.unsettled = 0
+        self.outcomes = collections.Counter()
+        # Unfinished batches of the link, to finish if the connection goes away
+        self.pending = pending
+        pending.add(self)
+
+    def add(self, delivery, size):
+        if not self.count:
+            self.first_tag = delivery.tag
+        self.last_tag = delivery.tag
+        self.count += 1
+        self.bytes += size
+        if delivery.settled:
+            self.outcomes['PRESETTLED'] += 1
+        else:
+            self.unsettled += 1
+
+    def settled(self, state):
+        self.outcomes[state] += 1
+        self.unsettled -= 1
+        if self.closed and not self.unsettled:
+            self._finish()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.unsettled:
+            self._finish()
+
+    def on_timer_task(self, event):
+        self.close()
+
+    def abandon(self, state):
+        """
+        Finish the span now, counting the unsettled deliveries as ``state``
+        """
+        self.closed = True
+        if self.unsettled:
+            self.outcomes[state] += self.unsettled
+            self.unsettled = 0
+        self._finish()
+
+    def _finish(self):
+        if self not in self.pending:
+            return
+        self.pending.discard(self)
+        span = self.span
+        span.set_tag('delivery-count', self.count)
+        span.set_tag('delivery-bytes', self.bytes)
+        span.set_tag('first-delivery-tag', self.first_tag)
+        span.set_tag('last-delivery-tag', self.last_tag)
+        for state, count in self.outcomes.items():
+            span.set_tag('delivery-outcome.%s' % state, count)
+        span.finish()
@@ -0,0 +1,97 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+"""
+Encodings of the trace context carried in the message annotations.
+
+The legacy encoding is the jaeger TEXT_MAP dict. The compact encodings follow
+the AMQP trace context draft: a W3C ``traceparent`` string or the same fields
+as a fixed 26 byte binary value (version, trace id, span id, flags). Readers
+tell the encodings apart by the annotation value type, so all of them can be
+read whichever one a process writes.
+"""
+
+import struct
+
+from jaeger_client import SpanContext
+from jaeger_client.constants import TRACE_ID_HEADER
+from opentracing.propagation import Format
+
+TEXT_MAP = 'text-map'
+TRACEPARENT = 'traceparent'
+BINARY = 'binary'
+
+ENCODINGS = (TEXT_MAP, TRACEPARENT, BINARY)
+
+_traceparent_format = '00-%032x-%016x-%02x'
+_traceparent_len = 55
+_binary = struct.Struct('!BQQQB')
+_mask64 = (1 << 64) - 1
+# proton may hand back AMQP binary as a memoryview
+_binary_types = (bytes, bytearray, memoryview)
+
+
+def inject(tracer, ctx, encoding):
+    """
+    :return: the annotation value carrying the span context ctx
+    """
+    if encoding == TEXT_MAP:
+        headers = {}
+        tracer.inject(ctx, Format.TEXT_MAP, headers)
+        return headers
+    if encoding == TRACEPARENT:
+        return _traceparent_format % (ctx.trace_id, ctx.span_id, ctx.flags & 0xff)
+    return _binary.pack(0, ctx.trace_id >> 64, ctx.trace_id & _mask64, ctx.span_id, ctx.flags & 0xff)
+
+
+def trace_flags(value):
+    """
+    Return just the flags of a propagated trace context without extracting it.
+
+    :return: the flags or None if the value holds no usable context
+    """
+    try:
+        if isinstance(value, str):
+            if len(value) == _traceparent_len and value[0:2] == '00':
+                return int(value[53:55], 16)
+            return None
+        if isinstance(value, _binary_types):
+            if len(value) == _binary.size and value[0] == 0:
+                return value[25]
+            return None
+        return int(value[TRACE_ID_HEADER].rsplit(':', 1)[1], 16)
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+def extract(tracer, value):
+    """
+    :return: the SpanContext carried by a value that trace_flags() accepted
+    """
+    if isinstance(value, str):
+        ctx = SpanContext(trace_id=int(value[3:35], 16), span_id=int(value[36:52], 16),
+                          parent_id=None, flags=int(value[53:55], 16))
+    elif isinstance(value, _binary_types):
+        _, high, low, span_id, flags = _binary.unpack(value)
+        ctx = SpanContext(trace_id=(high << 64) | low, span_id=span_id,
+                          parent_id=None, flags=flags)
+    else:
+        return tracer.extract(Format.TEXT_MAP, value)
+    return ctx
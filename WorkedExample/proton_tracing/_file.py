@@ -0,0 +1,209 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import concurrent.futures
+import json
+import os
+import struct
+import threading
+
+from jaeger_client.reporter import BaseReporter
+from opentracing.ext import tags
+
+# Each segment is a .spans file of a header and fixed size span records,
+# and a .strings file of the segment's strings, one JSON string per line;
+# a record's string fields are line numbers in it.
+MAGIC = b'PTSPANS\0'
+VERSION = 1
+HEADER = struct.Struct('<8sII')
+# trace id (high, low), span id, parent id (0 for none), start (microseconds
+# since the epoch), duration (microseconds), then the operation name,
+# destination address and delivery terminal state strings and the flags
+RECORD = struct.Struct('<QQQQqIHHHH')
+
+ERROR = 1
+TIMEOUT = 2
+
+_MAX_DURATION = 0xffffffff
+# Strings a segment can number in a record's 16 bit fields
+_MAX_STRINGS = 0x10000
+
+
+class FileReporter(BaseReporter):
+    """
+    Reporter appending every finished span as a 52 byte record to rotating
+    files in ``directory``, for reading back with ``span_analysis.py``.
+
+    Records are packed on the finishing thread into a buffer written out
+    when it reaches ``buffer_size`` bytes and every ``flush_interval``
+    seconds; nothing is encoded or sent over the network. The process
+    writes its own segments, named after its service and pid, moving to a
+    new one when a segment reaches ``max_bytes`` and deleting its oldest
+    beyond ``max_files``. It also moves on before a segment has more
+    distinct strings (operation names, addresses and delivery states) than
+    its records can number.
+
+    Use it with ``ConstSampler(True)`` to keep every span, or as the
+    ``reporter`` of a :class:`TailSamplingReporter`.
+    """
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_files=10, buffer_size=64 * 1024,
+                 flush_interval=1.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.reported = 0
+        self.written = 0
+        self._name = 'spans-%d' % os.getpid()
+        self._segments = []
+        self._sequence = 0
+        self._spans = None
+        self._strings = None
+        self._string_index = {}
+        self._new_strings = []
+        self._segment_bytes = 0
+        self._buffer = bytearray()
+        self._stopped = False
+        self._condition = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='proton-tracing-file-reporter', daemon=True)
+        self._thread.start()
+
+    def set_process(self, service_name, tags, max_length):
+        self._name = '%s-%d' % (service_name.replace(os.sep, '_'), os.getpid())
+
+    def _string(self, s):
+        index = self._string_index.get(s)
+        if index is None:
+            index = self._string_index[s] = len(self._string_index)
+            self._new_strings.append(s)
+        return index
+
+    def report_span(self, span):
+        address = ''
+        state = ''
+        flags = 0
+        for tag in span.tags:
+            key = tag.key
+            if key == tags.MESSAGE_BUS_DESTINATION:
+                address = tag.vStr or ''
+            elif key == 'delivery-terminal-state':
+                state = tag.vStr or ''
+            elif key == 'error' and tag.vBool:
+                flags |= ERROR
+            elif key == 'timeout' and tag.vBool:
+                flags |= TIMEOUT
+        context = span.context
+        start = span.start_time
+        duration = int((span.end_time - start) * 1e6)
+        with self._condition:
+            self.reported += 1
+            if self._stopped:
+                return
+            if len(self._string_index) + 3 > _MAX_STRINGS:
+                # The record's strings may all be new
+                self._write()
+                self._close_segment()
+                self._string_index = {}
+                self._new_strings = []
+            self._buffer += RECORD.pack(
+                context.trace_id >> 64, context.trace_id & 0xffffffffffffffff, context.span_id,
+                context.parent_id or 0, int(start * 1e6), max(0, min(duration, _MAX_DURATION)),
+                self._string(span.operation_name), self._string(address), self._string(state),
+                flags)
+            if len(self._buffer) >= self.buffer_size:
+                self._write()
+
+    def _open(self):
+        path = os.path.join(self.directory, '%s-%04d' % (self._name, self._sequence))
+        self._sequence += 1
+        self._segments.append(path)
+        self._spans = open(path + '.spans', 'wb')
+        self._strings = open(path + '.strings', 'w', encoding='utf-8')
+        self._spans.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._segment_bytes = HEADER.size
+        self._string_index = {}
+        self._new_strings = []
+        while len(self._segments) > self.max_files:
+            old = self._segments.pop(0)
+            for suffix in ('.spans', '.strings'):
+                try:
+                    os.remove(old + suffix)
+                except OSError:
+                    pass
+
+    def _close_segment(self):
+        if self._spans is not None:
+            self._spans.close()
+            self._strings.close()
+            self._spans = None
+            self._strings = None
+
+    def _write(self):
+        # Called with the lock held; a record's strings are written before it
+        buffer = self._buffer
+        if not buffer:
+            return
+        if self._spans is None:
+            # The buffered records' strings are numbered for the new segment
+            strings = self._new_strings
+            self._open()
+            self._string_index = dict((s, i) for i, s in enumerate(strings))
+            self._new_strings = strings
+        if self._new_strings:
+            self._strings.write(''.join(json.dumps(s) + '\n' for s in self._new_strings))
+            self._strings.flush()
+            self._new_strings = []
+        self._spans.write(buffer)
+        self._spans.flush()
+        self.written += len(buffer) // RECORD.size
+        self._segment_bytes += len(buffer)
+        self._buffer = bytearray()
+        if self._segment_bytes >= self.max_bytes:
+            # The next write starts a new segment with its own strings
+            self._close_segment()
+            self._string_index = {}
+            self._new_strings = []
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                self._condition.wait(self.flush_interval)
+                self._write()
+
+    def flush(self, timeout=None):
+        """
+        Write all buffered spans now.
+
+        :return: True
+        """
+        with self._condition:
+            self._write()
+        return True
+
+    def close(self):
+        with self._condition:
+            self._stopped = True
+            self._write()
+            self._close_segment()
+            self._condition.notify_all()
+        future = concurrent.futures.Future()
+        future.set_result(True)
+        return future
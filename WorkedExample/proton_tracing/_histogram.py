@@ -0,0 +1,108 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+import collections
+
+
+class Histogram(object):
+    """
+    Log-linear (HDR style) histogram of non-negative values such as latencies.
+
+    Values are counted in integer multiples of ``unit`` and bucketed with
+    ``precision_bits`` significant bits, so recording is O(1), memory grows
+    with the logarithm of the value range and quantiles are accurate to
+    within 2**(1 - precision_bits) of the true value.
+    """
+    def __init__(self, unit=1e-6, precision_bits=5):
+        self.unit = unit
+        self.precision_bits = precision_bits
+        self._half = 1 << (precision_bits - 1)
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _index(self, v):
+        shift = v.bit_length() - self.precision_bits
+        if shift <= 0:
+            return v
+        return shift * self._half + (v >> shift)
+
+    def _lowest(self, index):
+        if index < 2 * self._half:
+            return index
+        shift = index // self._half - 1
+        return (index - shift * self._half) << shift
+
+    def record(self, value):
+        v = int(value / self.unit)
+        if v < 0:
+            v = 0
+        self.counts[self._index(v)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def reset(self):
+        self.counts.clear()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """
+        :return: the value below which p percent of the recorded values lie
+        """
+        if not self.count:
+            return None
+        target = max(1, int(round(self.count * p / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                # Midpoint of the bucket clamped to the values actually seen
+                low = self._lowest(index)
+                high = self._lowest(index + 1)
+                value = (low + high - 1) / 2.0 * self.unit
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        s = {'count': self.count, 'mean': self.mean(), 'min': self.min, 'max': self.max}
+        for p in percentiles:
+            s['p%g' % p] = self.percentile(p)
+        return s
@@ -0,0 +1,167 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import collections
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ._histogram import Histogram
+
+
+class Counter(object):
+    """
+    Monotonic count updated in place; ``value`` may be read from any thread
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class _Metric(object):
+    def __init__(self, kind, name, help, source, label=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.source = source
+        self.label = label
+
+    def samples(self):
+        """
+        :return: list of (suffix, labels, value)
+        """
+        source = self.source
+        if isinstance(source, Counter):
+            return [('', '', source.value)]
+        if isinstance(source, Histogram):
+            if not source.count:
+                return [('_sum', '', 0.0), ('_count', '', 0)]
+            samples = [('', '{quantile="%g"}' % q, source.percentile(q * 100)) for q in (0.5, 0.9, 0.99)]
+            return samples + [('_sum', '', source.total), ('_count', '', source.count)]
+        value = source()
+        if self.label is None:
+            return [('', '', value)]
+        # Copied in one step as the container thread may be changing it
+        items = sorted(list(value.items()))
+        if isinstance(self.label, tuple):
+            return [('', '{%s}' % ','.join('%s="%s"' % (l, _escape(v)) for l, v in zip(self.label, k)), value)
+                    for k, value in items]
+        return [('', '{%s="%s"}' % (self.label, _escape(k)), v) for k, v in items]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """
+    Registry of counters, gauges and latency histograms exposed in the
+    Prometheus text format.
+
+    Counters and histograms are updated in place on the hot path and only
+    read when the metrics are collected. Gauges, and counters kept elsewhere,
+    are functions called at collection time; with ``label`` the function
+    returns a mapping from label value to value, or given a tuple of label
+    names, from a tuple of label values.
+    """
+    def __init__(self):
+        self._metrics = collections.OrderedDict()
+
+    def counter(self, name, help, function=None, label=None):
+        if function is not None:
+            self._metrics[name] = _Metric('counter', name, help, function, label)
+            return None
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = _Metric('counter', name, help, Counter())
+        return metric.source
+
+    def gauge(self, name, help, function, label=None):
+        self._metrics[name] = _Metric('gauge', name, help, function, label)
+
+    def histogram(self, name, help, unit=1e-6):
+        """
+        :return: a :class:`Histogram` of values in seconds, exposed as a summary
+        """
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = _Metric('summary', name, help, Histogram(unit))
+        return metric.source
+
+    def unregister(self, name):
+        self._metrics.pop(name, None)
+
+    def collect(self):
+        """
+        :return: every metric's current value in the Prometheus text format
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix, labels, _format(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+
+def _format(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+metrics = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.collect().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host='127.0.0.1', registry=None):
+    """
+    Serve the metrics for Prometheus to scrape at ``http://host:port/metrics``
+    from a daemon thread.
+
+    :return: the HTTP server; call its ``shutdown()`` to stop it
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.metrics = registry if registry is not None else metrics
+    thread = threading.Thread(target=server.serve_forever, name='proton-tracing-metrics', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,72 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import fnmatch
+
+from ._sampling import ConstSampler, ProbabilisticSampler, Sampler
+
+
+class TracePolicy(object):
+    """
+    How deliveries on links with a matching address are traced.
+
+    :param sample: ``True`` to sample every trace started on the link,
+        ``False`` to never trace the link (not even under a sampled parent),
+        a probability, a jaeger sampler, or ``None`` to use the tracer's sampler
+    :param tags: extra tags for every delivery span on the link
+    :param batch: if set, deliveries sent on the link within this many
+        seconds share one 'amqp-delivery-send-batch' span rather than each
+        having its own; meant for bulk flows
+    """
+    def __init__(self, sample=None, tags=None, batch=None):
+        self.trace = sample is not False
+        if sample is None or sample is False:
+            self.sampler = None
+        elif sample is True:
+            self.sampler = ConstSampler(True)
+        elif isinstance(sample, Sampler):
+            self.sampler = sample
+        else:
+            self.sampler = ProbabilisticSampler(sample)
+        self.tags = dict(tags or {})
+        self.batch = batch
+
+    def __repr__(self):
+        if not self.trace:
+            return 'TracePolicy(False)'
+        return 'TracePolicy(%s, tags=%r, batch=%r)' % (self.sampler, self.tags, self.batch)
+
+
+class PolicyTable(object):
+    """
+    Ordered table of (address pattern, :class:`TracePolicy`) pairs.
+
+    Patterns are shell style (``orders.*``); the first match wins and
+    addresses matching nothing get ``default``.
+    """
+    def __init__(self, policies=(), default=None):
+        self.policies = list(policies)
+        self.default = default if default is not None else TracePolicy()
+
+    def lookup(self, address):
+        address = address or ''
+        for pattern, policy in self.policies:
+            if fnmatch.fnmatchcase(address, pattern):
+                return policy
+        return self.default
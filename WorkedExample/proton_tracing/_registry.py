@@ -0,0 +1,124 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+import collections
+import time
+
+from ._metrics import metrics
+
+_abandoned = metrics.counter('proton_tracing_delivery_spans_abandoned_total',
+                             'Delivery spans finished without the delivery being settled')
+
+
+class DeliverySpans(object):
+    """
+    Registry of the open spans of a connection's unsettled outgoing deliveries.
+
+    Spans are kept in send order so that spans outstanding for longer than
+    ``timeout`` seconds can be finished from the front. When more than
+    ``max_spans`` are outstanding the oldest is finished to make room, and
+    everything left is finished when the connection goes away.
+
+    Given the connection's ``container``, the registry is also a timer task
+    scheduled for the oldest span's deadline, so spans time out even when
+    nothing more is sent; otherwise they are only expired as spans are added.
+    """
+    TIMED_OUT = 'TIMED_OUT'
+    EVICTED = 'EVICTED'
+    CONNECTION_CLOSED = 'CONNECTION_CLOSED'
+    ABORTED = 'ABORTED'
+
+    # Spans outstanding in all registries
+    outstanding = 0
+
+    def __init__(self, timeout=60.0, max_spans=10000, container=None):
+        self.timeout = timeout
+        self.max_spans = max_spans
+        self.container = container
+        self._spans = collections.OrderedDict()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._spans)
+
+    def add(self, span):
+        now = time.monotonic()
+        self.expire(now)
+        self._spans[span] = now + self.timeout
+        DeliverySpans.outstanding += 1
+        if len(self._spans) > self.max_spans:
+            DeliverySpans.outstanding -= 1
+            _finish(self._spans.popitem(last=False)[0], self.EVICTED)
+        if self._timer is None and self.container is not None:
+            self._timer = self.container.schedule(self.timeout, self)
+
+    def remove(self, span):
+        """
+        :return: True if the span was still outstanding and must be finished by the caller
+        """
+        if self._spans.pop(span, None) is None:
+            return False
+        DeliverySpans.outstanding -= 1
+        return True
+
+    def expire(self, now=None):
+        if not self._spans:
+            return
+        if now is None:
+            now = time.monotonic()
+        spans = self._spans
+        while spans:
+            span, deadline = next(iter(spans.items()))
+            if deadline > now:
+                break
+            del spans[span]
+            DeliverySpans.outstanding -= 1
+            _finish(span, self.TIMED_OUT)
+
+    def on_timer_task(self, event):
+        self._timer = None
+        now = time.monotonic()
+        self.expire(now)
+        if self._spans:
+            deadline = next(iter(self._spans.values()))
+            self._timer = event.container.schedule(max(deadline - now, 0.0), self)
+
+    def close(self):
+        if self._timer is not None:
+            # A cancelled task stays in the container until it comes due, so
+            # it is replaced with one due now, which finds nothing to expire
+            self._timer.cancel()
+            self._timer = self.container.schedule(0, self)
+        spans = self._spans
+        self._spans = collections.OrderedDict()
+        DeliverySpans.outstanding -= len(spans)
+        for span in spans:
+            _finish(span, self.CONNECTION_CLOSED)
+
+
+metrics.gauge('proton_tracing_open_delivery_spans', 'Spans of outgoing deliveries not yet settled',
+              lambda: DeliverySpans.outstanding)
+
+
+def _finish(span, state):
+    _abandoned.inc()
+    span.set_tag('delivery-terminal-state', state)
+    span.log_kv({'event': 'delivery abandoned', 'state': state})
+    span.finish()
@@ -0,0 +1,239 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+import collections
+import concurrent.futures
+import socket
+import threading
+
+from jaeger_client import thrift
+from jaeger_client.reporter import BaseReporter
+from jaeger_client.thrift_gen.agent import Agent
+from thrift.protocol import TCompactProtocol
+from thrift.Thrift import TMessageType
+from thrift.transport import TTransport
+
+
+class _ThreadSpans(object):
+    """
+    The spans finished on one thread and not yet taken by the sending thread
+    """
+    __slots__ = ('thread', 'spans', 'reported', 'dropped')
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        # Appended by its own thread and taken from by the sending thread,
+        # which deque allows without a lock
+        self.spans = collections.deque()
+        self.reported = 0
+        self.dropped = 0
+
+
+class BatchReporter(BaseReporter):
+    """
+    Reporter sending spans to the jaeger agent over UDP from a background thread.
+
+    Finished spans, counted in ``reported``, go into a buffer of the thread
+    finishing them, so that containers running on several threads do not
+    contend for the reporter. Each thread buffers at most ``queue_size``
+    spans; spans arriving when its buffer is full are dropped and counted in
+    ``dropped``. The buffers are sent in batches of up to ``batch_size``
+    spans as soon as one holds a full batch and otherwise every
+    ``flush_interval`` seconds. A batch encoding to more than
+    ``max_packet_size`` bytes is split until each part fits in one UDP
+    packet; a span too large to fit on its own is dropped and counted in
+    ``too_large``.
+    """
+    def __init__(self, host='localhost', port=6831, queue_size=10000, batch_size=50,
+                 flush_interval=1.0, close_timeout=5.0, max_packet_size=65000):
+        if queue_size < batch_size:
+            raise ValueError('Queue size cannot be less than batch size')
+        self.address = (host, port)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.close_timeout = close_timeout
+        self.max_packet_size = max_packet_size
+        self.sent = 0
+        self.failed = 0
+        self.too_large = 0
+        self._local = threading.local()
+        self._buffers = []
+        self._next = 0
+        # Counts of the threads that have finished
+        self._retired_reported = 0
+        self._retired_dropped = 0
+        self._in_flight = 0
+        self._full = False
+        self._flushing = False
+        self._stopped = False
+        self._condition = threading.Condition()
+        self._process = None
+        self._seqid = 0
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread = threading.Thread(target=self._run, name='proton-tracing-reporter', daemon=True)
+        self._thread.start()
+
+    @property
+    def reported(self):
+        return self._retired_reported + sum(b.reported for b in list(self._buffers))
+
+    @property
+    def dropped(self):
+        return self._retired_dropped + sum(b.dropped for b in list(self._buffers))
+
+    def set_process(self, service_name, tags, max_length):
+        self._process = thrift.make_process(service_name=service_name, tags=tags, max_length=max_length)
+
+    def _thread_spans(self):
+        buffer = self._local.buffer = _ThreadSpans()
+        with self._condition:
+            self._buffers.append(buffer)
+        return buffer
+
+    def report_span(self, span):
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = self._thread_spans()
+        buffer.reported += 1
+        spans = buffer.spans
+        if self._stopped or len(spans) >= self.queue_size:
+            buffer.dropped += 1
+            return
+        spans.append(span)
+        if len(spans) == self.batch_size:
+            with self._condition:
+                self._full = True
+                self._condition.notify_all()
+
+    def queue_depth(self):
+        return sum(len(b.spans) for b in list(self._buffers))
+
+    def flush(self, timeout=None):
+        """
+        Send all buffered spans now.
+
+        :return: True if the buffers were drained within timeout seconds
+        """
+        with self._condition:
+            self._flushing = True
+            self._condition.notify_all()
+            drained = self._condition.wait_for(lambda: not self.queue_depth() and not self._in_flight, timeout)
+            self._flushing = False
+            return drained
+
+    def shutdown(self, timeout=None):
+        """
+        Flush the buffers and stop the sending thread; later spans are dropped.
+
+        :return: True if the buffers were drained within timeout seconds
+        """
+        with self._condition:
+            if self._stopped:
+                return not self.queue_depth()
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def close(self):
+        future = concurrent.futures.Future()
+        future.set_result(self.shutdown(self.close_timeout))
+        return future
+
+    def _ready(self):
+        return self._full or self._flushing or self._stopped
+
+    def _take(self):
+        """
+        :return: up to a batch of spans, taken from the buffers in turn
+        """
+        buffers = self._buffers
+        spans = []
+        for _ in range(len(buffers)):
+            if self._next >= len(buffers):
+                self._next = 0
+            buffer = buffers[self._next]
+            pending = buffer.spans
+            while pending and len(spans) < self.batch_size:
+                spans.append(pending.popleft())
+            # The next batch starts from the next buffer, so that a busy
+            # thread does not hold up the others
+            self._next += 1
+            if not pending and not buffer.thread.is_alive():
+                # Keep the counts of a finished thread, not its buffer
+                self._retire(buffer)
+            if len(spans) == self.batch_size:
+                break
+        return spans
+
+    def _retire(self, buffer):
+        self._buffers.remove(buffer)
+        self._next -= 1
+        self._retired_reported += buffer.reported
+        self._retired_dropped += buffer.dropped
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._ready, self.flush_interval)
+                self._full = False
+                spans = self._take()
+                if not spans and self._stopped:
+                    return
+                self._in_flight = len(spans)
+            while spans:
+                self._send(spans)
+                with self._condition:
+                    spans = self._take()
+                    self._in_flight = len(spans)
+            with self._condition:
+                self._condition.notify_all()
+
+    def _send(self, spans):
+        if self._process is None:
+            self.failed += len(spans)
+            return
+        packet = self._encode(spans)
+        if len(packet) > self.max_packet_size:
+            if len(spans) == 1:
+                self.too_large += 1
+                return
+            # Rare enough that encoding the halves again costs little
+            half = len(spans) // 2
+            self._send(spans[:half])
+            self._send(spans[half:])
+            return
+        try:
+            self._socket.sendto(packet, self.address)
+            self.sent += len(spans)
+        except socket.error:
+            self.failed += len(spans)
+
+    def _encode(self, spans):
+        self._seqid += 1
+        buffer = TTransport.TMemoryBuffer()
+        protocol = TCompactProtocol.TCompactProtocol(buffer)
+        protocol.writeMessageBegin('emitBatch', TMessageType.ONEWAY, self._seqid)
+        args = Agent.emitBatch_args()
+        args.batch = thrift.make_jaeger_batch(spans=spans, process=self._process)
+        args.write(protocol)
+        protocol.writeMessageEnd()
+        return buffer.getvalue()
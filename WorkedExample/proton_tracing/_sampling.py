@@ -0,0 +1,47 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from jaeger_client.sampler import (
+    Sampler, ConstSampler, ProbabilisticSampler, RateLimitingSampler
+)
+
+
+class AddressSampler(Sampler):
+    """
+    Sampler that picks a per address sampler for new traces.
+
+    Traces started for proton deliveries are keyed by the link address, other
+    traces by their operation name; anything not in the table uses ``default``.
+    """
+    def __init__(self, samplers, default=None):
+        super(AddressSampler, self).__init__()
+        self.samplers = dict(samplers)
+        self.default = default if default is not None else ConstSampler(True)
+
+    def is_sampled(self, trace_id, operation=''):
+        return self.samplers.get(operation, self.default).is_sampled(trace_id, operation)
+
+    def close(self):
+        for s in self.samplers.values():
+            s.close()
+        self.default.close()
+
+    def __str__(self):
+        return 'AddressSampler(%s, default=%s)' % (
+            ', '.join('%s=%s' % i for i in self.samplers.items()), self.default)
@@ -0,0 +1,68 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+from opentracing import Scope, ScopeManager
+
+
+class ReactorScopeManager(ScopeManager):
+    """
+    Scope manager for processes that only activate spans on the container
+    thread.
+
+    Proton dispatches every event on that one thread, so the active scopes
+    are kept on a plain list rather than in thread local storage. Scopes
+    that handlers activate themselves nest as usual, and a scope closed out
+    of order is taken out of the stack wherever it is. Scope handling is a
+    small part of what a sampled message costs, so this is not measurably
+    faster than the thread local manager. Not for use where
+    other threads activate spans too, such as a server with a worker pool
+    or a process running containers on several threads.
+    """
+    def __init__(self):
+        self._stack = []
+
+    def activate(self, span, finish_on_close):
+        scope = _ReactorScope(self, span, finish_on_close)
+        self._stack.append(scope)
+        return scope
+
+    @property
+    def active(self):
+        stack = self._stack
+        return stack[-1] if stack else None
+
+
+class _ReactorScope(Scope):
+    def __init__(self, manager, span, finish_on_close):
+        self._manager = manager
+        self._span = span
+        self._finish_on_close = finish_on_close
+
+    def close(self):
+        stack = self._manager._stack
+        if stack and stack[-1] is self:
+            stack.pop()
+        else:
+            try:
+                stack.remove(self)
+            except ValueError:
+                # Already closed
+                return
+        if self._finish_on_close:
+            self._span.finish()
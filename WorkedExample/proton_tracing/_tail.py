@@ -0,0 +1,135 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import collections
+import threading
+import time
+
+from jaeger_client.reporter import BaseReporter
+
+from ._metrics import metrics
+
+_kept = metrics.counter('proton_tracing_tail_traces_kept_total', 'Traces exported by tail sampling')
+_discarded = metrics.counter('proton_tracing_tail_traces_discarded_total',
+                             'Traces whose buffered spans tail sampling discarded')
+
+# Terminal states of a delivery that do not make its trace interesting
+_ORDINARY_STATES = frozenset(['ACCEPTED', 'PRESETTLED'])
+
+
+class _Trace(object):
+    __slots__ = ('expires', 'spans', 'keep')
+
+    def __init__(self, expires, keep):
+        self.expires = expires
+        self.spans = []
+        self.keep = keep
+
+
+class TailSamplingReporter(BaseReporter):
+    """
+    Reporter holding finished spans per trace for ``window`` seconds and
+    passing on to ``reporter`` only the traces worth keeping.
+
+    A trace is kept once any of its spans took longer than
+    ``latency_threshold`` seconds, is tagged as an error or timeout, or has a
+    ``delivery-terminal-state`` other than accepted or presettled (such as
+    REJECTED, RELEASED or TIMED_OUT), or is a send batch with deliveries
+    reaching such a state. A ``baseline`` fraction of traces
+    chosen from their trace id, so every process picks the same ones, is
+    kept regardless. Spans of a kept trace are passed on straight away; the
+    rest are discarded when their window ends, and at most ``max_traces``
+    traces are held.
+
+    Decisions are made per process, so head sampling should let everything
+    through (``ConstSampler(True)``) and each process exports only its own
+    part of an interesting trace. ``reporter`` defaults to a
+    :class:`BatchReporter` sending to the configured agent.
+    """
+    def __init__(self, reporter=None, latency_threshold=1.0, baseline=0.001, window=10.0,
+                 max_traces=10000):
+        self.reporter = reporter
+        self.latency_threshold = latency_threshold
+        self.baseline = int(baseline * (1 << 16))
+        self.window = window
+        self.max_traces = max_traces
+        self._traces = collections.OrderedDict()
+        self._lock = threading.Lock()
+        metrics.gauge('proton_tracing_tail_buffered_traces', 'Traces whose spans tail sampling is holding',
+                      lambda: len(self._traces))
+
+    def set_process(self, service_name, tags, max_length):
+        self.reporter.set_process(service_name, tags, max_length)
+
+    def _interesting(self, span):
+        if span.end_time - span.start_time > self.latency_threshold:
+            return True
+        for tag in span.tags:
+            if (tag.key == 'error' or tag.key == 'timeout') and tag.vBool:
+                return True
+            if tag.key == 'delivery-terminal-state' and tag.vStr not in _ORDINARY_STATES:
+                return True
+            # A send batch counts its deliveries per outcome
+            if tag.key.startswith('delivery-outcome.') and tag.key[17:] not in _ORDINARY_STATES:
+                return True
+        return False
+
+    def report_span(self, span):
+        trace_id = span.context.trace_id
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                trace = _Trace(now + self.window, (trace_id & 0xffff) < self.baseline)
+                self._traces[trace_id] = trace
+                if len(self._traces) > self.max_traces and not self._traces.popitem(last=False)[1].keep:
+                    _discarded.inc()
+                if trace.keep:
+                    _kept.inc()
+            if trace.keep:
+                spans = [span]
+            elif self._interesting(span):
+                trace.keep = True
+                spans = trace.spans + [span]
+                trace.spans = None
+                _kept.inc()
+            else:
+                trace.spans.append(span)
+                return
+        for s in spans:
+            self.reporter.report_span(s)
+
+    def _expire(self, now):
+        traces = self._traces
+        while traces:
+            trace_id, trace = next(iter(traces.items()))
+            if trace.expires > now:
+                return
+            del traces[trace_id]
+            if not trace.keep:
+                _discarded.inc()
+
+    def flush(self, timeout=None):
+        return self.reporter.flush(timeout)
+
+    def close(self):
+        with self._lock:
+            self._traces.clear()
+        return self.reporter.close()
@@ -21,118 +21,519 @@ import atexit
 import functools
 import os
 import sys
+import threading
 import time
 import weakref
 
 try:
     import opentracing
     import jaeger_client
+    from jaeger_client import Span, SpanContext
+    from jaeger_client.constants import SAMPLED_FLAG
     from opentracing.ext import tags
-    from opentracing.propagation import Format
 except ImportError:
     raise ImportError('proton tracing requires opentracing and jaeger_client modules')
 
 import proton
-from proton import Sender as ProtonSender
+from proton import Delivery, Sender as ProtonSender
 from proton.handlers import (
     OutgoingMessageHandler as ProtonOutgoingMessageHandler,
     IncomingMessageHandler as ProtonIncomingMessageHandler
 )
 
+from . import _encoding
+from ._batch import SendBatch
+from ._file import FileReporter
+from ._metrics import metrics
+from ._policy import PolicyTable
+from ._registry import DeliverySpans
+from ._reporter import BatchReporter
+from ._tail import TailSamplingReporter
+from ._transit import TRANSIT_KEY, TransitLatency, stamp_sent
+
 _tracer = None
+# Held while the settings are recorded and the tracer created, so that
+# containers on several threads agree on one; once it exists it is read
+# without the lock
+_tracer_lock = threading.Lock()
+# (service_name, sampler, reporter, scope_manager) recorded by init_tracer for when the tracer is created
+_settings = None
 _trace_key = proton.symbol('x-opt-qpid-tracestate')
+_trace_encoding = _encoding.TEXT_MAP
+_delivery_timeout = 60.0
+_max_delivery_spans = 10000
+_policies = None
+# TransitLatency when init_tracer was given transit=True
+_transit = None
+
+_send_spans = metrics.counter('proton_tracing_send_spans_total', 'Spans started for sent deliveries')
+_receive_spans = metrics.counter('proton_tracing_receive_spans_total', 'Spans started for received messages')
+_settled_spans = metrics.counter('proton_tracing_delivery_spans_settled_total',
+                                 'Delivery spans finished when the delivery was settled')
+_inject_time = metrics.histogram('proton_tracing_inject_seconds',
+                                 'Time taken to write the trace context into a message', unit=1e-7)
+_extract_time = metrics.histogram('proton_tracing_extract_seconds',
+                                  'Time taken to read the trace context from a message', unit=1e-7)
 
 def get_tracer():
-    global _tracer
     if _tracer is not None:
         return _tracer
-    exe = sys.argv[0] if sys.argv[0] else 'interactive-session'
-    return init_tracer(os.path.basename(exe))
+    return _create_tracer()
+
+def _create_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is not None:
+            return _tracer
+        if _settings is None:
+            exe = sys.argv[0] if sys.argv[0] else 'interactive-session'
+            service_name, sampler, reporter, scope_manager = os.path.basename(exe), None, None, None
+        else:
+            service_name, sampler, reporter, scope_manager = _settings
+        config = _Config(service_name, sampler, reporter, scope_manager)
+        config.initialize_tracer()
+        tracer = opentracing.global_tracer()
+        reporter = tracer.reporter
+        if isinstance(reporter, TailSamplingReporter):
+            reporter = reporter.reporter
+        if isinstance(reporter, BatchReporter):
+            _reporter_metrics(reporter)
+        elif isinstance(reporter, FileReporter):
+            _file_reporter_metrics(reporter)
+        atexit.register(_fini_tracer)
+        # Only published once complete
+        _tracer = tracer
+        return tracer
+
+def _reporter_metrics(reporter):
+    metrics.counter('proton_tracing_spans_finished_total', 'Sampled spans finished and given to the reporter',
+                    lambda: reporter.reported)
+    metrics.counter('proton_tracing_spans_dropped_total', 'Spans dropped because the reporter buffer was full',
+                    lambda: reporter.dropped)
+    metrics.counter('proton_tracing_spans_sent_total', 'Spans sent to the agent', lambda: reporter.sent)
+    metrics.counter('proton_tracing_spans_failed_total', 'Spans that could not be sent to the agent',
+                    lambda: reporter.failed)
+    metrics.counter('proton_tracing_spans_too_large_total', 'Spans dropped as too large for a UDP packet on their own',
+                    lambda: reporter.too_large)
+    metrics.gauge('proton_tracing_reporter_queue_depth', 'Finished spans waiting to be sent', reporter.queue_depth)
+
+def _file_reporter_metrics(reporter):
+    metrics.counter('proton_tracing_spans_finished_total', 'Sampled spans finished and given to the reporter',
+                    lambda: reporter.reported)
+    metrics.counter('proton_tracing_spans_written_total', 'Spans written to the span files',
+                    lambda: reporter.written)
+
+class _LazyTracer(object):
+    """
+    Stands in for the tracer until something uses it, then creates it
+    """
+    def __getattr__(self, name):
+        return getattr(get_tracer(), name)
+
+_lazy_tracer = _LazyTracer()
+
+def flush_tracer(timeout=None):
+    """
+    Send all finished spans to the agent now.
+
+    :return: True if everything was sent within timeout seconds
+    """
+    if _tracer is None:
+        return True
+    return _tracer.reporter.flush(timeout)
 
 def _fini_tracer():
-    time.sleep(1)
-    c = opentracing.global_tracer().close()
-    while not c.done():
-        time.sleep(0.5)
+    _tracer.close()
 
-def init_tracer(service_name):
-    global _tracer
-    if _tracer is not None:
-        return _tracer
 
-    config = jaeger_client.Config(
-        config={},
-        service_name=service_name,
-        validate=True
-    )
-    config.initialize_tracer()
-    _tracer = opentracing.global_tracer()
-    # A nasty hack to ensure enough time for the tracing data to be flushed
-    atexit.register(_fini_tracer)
-    return _tracer
+class _Config(jaeger_client.Config):
+    """
+    jaeger Config creating the tracer with our own sampler and reporter
+    """
+    def __init__(self, service_name, sampler, reporter, scope_manager):
+        # A const sampler config stops jaeger starting the agent sampling poller
+        config = {} if sampler is None else {'sampler': {'type': 'const', 'param': 1}}
+        super(_Config, self).__init__(config=config, service_name=service_name, validate=True,
+                                      scope_manager=scope_manager)
+        self._sampler = sampler
+        self._reporter = reporter
+
+    def create_tracer(self, reporter, sampler, throttler=None):
+        # The default jaeger reporter is replaced before it sees any spans.
+        # Its close() wants an asyncio loop, which only its own io_loop
+        # thread is sure to have when a container thread creates the tracer
+        io_loop = getattr(reporter, 'io_loop', None)
+        if io_loop is not None:
+            io_loop.add_callback(reporter.close)
+        else:
+            reporter.close()
+        if self._reporter is None:
+            self._reporter = BatchReporter(self.local_agent_reporting_host, self.local_agent_reporting_port)
+        elif isinstance(self._reporter, TailSamplingReporter) and self._reporter.reporter is None:
+            self._reporter.reporter = BatchReporter(self.local_agent_reporting_host,
+                                                    self.local_agent_reporting_port)
+        return super(_Config, self).create_tracer(
+            reporter=self._reporter, sampler=self._sampler or sampler, throttler=throttler)
+
+def init_tracer(service_name, sampler=None, encoding=_encoding.TEXT_MAP, reporter=None,
+                delivery_timeout=60.0, max_delivery_spans=10000, scope_manager=None, policies=None,
+                transit=False):
+    """
+    Configure tracing for this process; only the first call has any effect.
+    It may be called from any thread, and a process may run traced
+    containers on several threads at once.
+
+    The tracer is not created until it is first used, either by a traced
+    send or receive or through the returned stand in.
+
+    :param sampler: optional jaeger sampler (for example ``ProbabilisticSampler``,
+        ``RateLimitingSampler`` or :class:`AddressSampler`) used instead of the
+        agent controlled sampler. Deliveries the sampler drops have no span
+        reported, but carry an unsampled trace context of their own so that
+        the hops after them do not sample them afresh.
+    :param encoding: how sent messages carry the trace context: ``'text-map'``
+        (the legacy jaeger dict), ``'traceparent'`` (a W3C traceparent string) or
+        ``'binary'`` (26 bytes). The compact encodings do not carry baggage.
+        Received messages are understood in any encoding.
+    :param reporter: optional :class:`BatchReporter` to control the span buffer
+        size and batching, or :class:`TailSamplingReporter` to export only
+        slow or failed traces, or :class:`FileReporter` to record spans to
+        local files; by default a BatchReporter sending to the configured
+        agent.
+    :param delivery_timeout: seconds after which the span of an unsettled
+        outgoing delivery is finished as ``TIMED_OUT``.
+    :param max_delivery_spans: most unsettled delivery spans kept per
+        connection; beyond this the oldest is finished as ``EVICTED``.
+    :param scope_manager: optional opentracing scope manager; the default is
+        thread local, asyncio code wants a ``ContextVarsScopeManager`` and a
+        process running one container can use :class:`ReactorScopeManager`.
+    :param policies: optional :class:`PolicyTable`, or sequence of (address
+        pattern, :class:`TracePolicy`) pairs, choosing per link whether and
+        how it is sampled and what extra tags its spans get. A link's policy
+        and span tags are worked out on its first delivery and kept until
+        its connection's transport closes.
+    :param transit: if True stamp every message sent with the time, in an
+        ``x-opt-qpid-transit`` annotation separate from the trace context,
+        and record how long received messages carrying one took to arrive
+        and to pass each hop that stamped them (see :func:`stamp_transit`)
+        in :func:`transit_latency`, whether or not they are sampled.
+    """
+    global _settings, _trace_encoding, _delivery_timeout, _max_delivery_spans, _policies, _transit
+    with _tracer_lock:
+        if _tracer is not None:
+            return _tracer
+        if _settings is not None:
+            return _lazy_tracer
+        if encoding not in _encoding.ENCODINGS:
+            raise ValueError('unknown trace context encoding: %s' % encoding)
+        _trace_encoding = encoding
+        _delivery_timeout = delivery_timeout
+        _max_delivery_spans = max_delivery_spans
+        if policies is not None and not isinstance(policies, PolicyTable):
+            policies = PolicyTable(policies)
+        _policies = policies
+        if transit:
+            _transit = TransitLatency(registry=metrics)
+        _settings = (service_name, sampler, reporter, scope_manager)
+    return _lazy_tracer
+
+
+def _sample_root(tracer, link_tracing):
+    """
+    Make the head sampling decision for a new trace keyed on the link address.
+
+    :return: (trace_id, sampler_tags), with sampler_tags None if not sampled
+    """
+    trace_id = tracer._random_id(tracer.max_trace_id_bits)
+    sampler = link_tracing.sampler or tracer.sampler
+    sampled, sampler_tags = sampler.is_sampled(trace_id, link_tracing.address)
+    if sampled:
+        return trace_id, sampler_tags
+    return trace_id, None
+
+def _start_root_span(tracer, operation_name, trace_id, sampler_tags, span_tags):
+    # Equivalent to tracer.start_span() for a root span, but reusing the
+    # sampling decision we have already made
+    span_tags = dict(span_tags, **sampler_tags)
+    span_ctx = SpanContext(trace_id=trace_id, span_id=tracer._random_id(64),
+                           parent_id=None, flags=SAMPLED_FLAG)
+    return Span(context=span_ctx, tracer=tracer, operation_name=operation_name, tags=span_tags)
+
+def _unsampled_context(tracer, trace_id=None, parent=None):
+    # Context of a send or receive that is not sampled, in the trace of
+    # parent or else a new trace_id. Nothing is reported for it, but it
+    # keeps what follows, even if forced to be sampled, in a trace of its own
+    if parent is None:
+        return SpanContext(trace_id=trace_id, span_id=tracer._random_id(64), parent_id=None, flags=0)
+    return SpanContext(trace_id=parent.trace_id, span_id=tracer._random_id(64), parent_id=parent.span_id,
+                       flags=parent.flags, baggage=parent.baggage)
+
+def _delivery_spans(connection):
+    spans = getattr(connection, 'delivery_spans', None)
+    if spans is None:
+        # The container is set on the connection before it has a transport
+        spans = DeliverySpans(_delivery_timeout, _max_delivery_spans, getattr(connection, '_reactor', None))
+        connection.delivery_spans = spans
+    return spans
+
+class _LinkTracing(object):
+    """
+    A link's tracing policy and the tags for its delivery spans
+    """
+    __slots__ = ('trace', 'address', 'sampler', 'span_tags', 'batch_interval', 'batch', 'batches')
+
+    def __init__(self, trace, address, sampler, span_tags, batch_interval=None):
+        self.trace = trace
+        self.address = address
+        self.sampler = sampler
+        self.span_tags = span_tags
+        self.batch_interval = batch_interval
+        # The batch being filled and all those not yet finished
+        self.batch = None
+        self.batches = set()
+
+def _link_tracing(link, address, kind):
+    policy = _policies.lookup(address) if _policies is not None else None
+    connection = link.connection
+    span_tags = {
+        tags.SPAN_KIND: kind,
+        tags.MESSAGE_BUS_DESTINATION: address,
+        tags.PEER_ADDRESS: connection.connected_address,
+        tags.PEER_HOSTNAME: connection.hostname,
+        'inserted_by': 'proton-message-tracing'
+    }
+    if policy is None:
+        tracing = _LinkTracing(True, address or '', None, span_tags)
+    else:
+        span_tags.update(policy.tags)
+        tracing = _LinkTracing(policy.trace, address or '', policy.sampler, span_tags, policy.batch)
+    link.tracing = tracing
+    return tracing
+
+def _forget_link_tracing(connection):
+    # After a reconnect links may be on another peer
+    link = connection.link_head(0)
+    while link is not None:
+        tracing = getattr(link, 'tracing', None)
+        if tracing is not None:
+            for batch in list(tracing.batches):
+                batch.abandon(DeliverySpans.CONNECTION_CLOSED)
+        link.tracing = None
+        link = link.next(0)
 
 
 class IncomingMessageHandler(ProtonIncomingMessageHandler):
     def on_message(self, event):
         if self.delegate is not None:
             tracer = get_tracer()
-            message = event.message
             receiver = event.receiver
-            connection = event.connection
-            span_tags = {
-                tags.SPAN_KIND: tags.SPAN_KIND_CONSUMER,
-                tags.MESSAGE_BUS_DESTINATION: receiver.source.address,
-                tags.PEER_ADDRESS: connection.connected_address,
-                tags.PEER_HOSTNAME: connection.hostname,
-                'inserted_by': 'proton-message-tracing'
-            }
-            if message.annotations is not None:
-                headers = message.annotations[_trace_key]
-                span_ctx = tracer.extract(Format.TEXT_MAP, headers)
-                with tracer.start_active_span('amqp-delivery-receive', child_of=span_ctx, tags=span_tags):
-                    proton._events._dispatch(self.delegate, 'on_message', event)
+            link_tracing = getattr(receiver, 'tracing', None)
+            if link_tracing is None:
+                link_tracing = _link_tracing(receiver, receiver.source.address, tags.SPAN_KIND_CONSUMER)
+            annotations = event.message.annotations
+            if _transit is not None and annotations:
+                stamps = annotations.get(TRANSIT_KEY)
+                if stamps is not None:
+                    _transit.record(link_tracing.address, stamps)
+            if not link_tracing.trace:
+                proton._events._dispatch(self.delegate, 'on_message', event)
+                return
+            headers = annotations.get(_trace_key) if annotations is not None else None
+            flags = _encoding.trace_flags(headers) if headers is not None else None
+            if flags is None:
+                trace_id, sampler_tags = _sample_root(tracer, link_tracing)
+                if sampler_tags is None:
+                    self._dispatch_unsampled(tracer, event, _unsampled_context(tracer, trace_id))
+                    return
+            elif not flags & SAMPLED_FLAG:
+                parent = _encoding.extract(tracer, headers)
+                self._dispatch_unsampled(tracer, event, _unsampled_context(tracer, parent=parent))
+                return
+            _receive_spans.inc()
+            if flags is not None:
+                start = time.perf_counter()
+                span_ctx = _encoding.extract(tracer, headers)
+                _extract_time.record(time.perf_counter() - start)
+                span = tracer.start_span('amqp-delivery-receive', child_of=span_ctx, tags=link_tracing.span_tags)
             else:
-                with tracer.start_active_span('amqp-delivery-receive', ignore_active_span=True, tags=span_tags):
-                    proton._events._dispatch(self.delegate, 'on_message', event)
+                span = _start_root_span(tracer, 'amqp-delivery-receive', trace_id, sampler_tags,
+                                        link_tracing.span_tags)
+            with tracer.scope_manager.activate(span, True):
+                proton._events._dispatch(self.delegate, 'on_message', event)
+
+    def _dispatch_unsampled(self, tracer, event, span_ctx):
+        # The span is never finished, but anything sent or traced while
+        # handling the message joins its trace unsampled
+        span = Span(context=span_ctx, tracer=tracer, operation_name='amqp-delivery-receive')
+        with tracer.scope_manager.activate(span, False):
+            proton._events._dispatch(self.delegate, 'on_message', event)
 
 class OutgoingMessageHandler(ProtonOutgoingMessageHandler):
     def on_settled(self, event):
-        if self.delegate is not None:
-            delivery = event.delivery
+        delivery = event.delivery
+        span = getattr(delivery, 'span', None)
+        if span is not None and _delivery_spans(event.connection).remove(span):
             state = delivery.remote_state
-            span = delivery.span
             span.set_tag('delivery-terminal-state', state.name)
             span.log_kv({'event': 'delivery settled', 'state': state.name})
             span.finish()
+            _settled_spans.inc()
+        else:
+            batch = getattr(delivery, 'batch', None)
+            if batch is not None:
+                batch.settled(delivery.remote_state.name)
+        if self.delegate is not None:
             proton._events._dispatch(self.delegate, 'on_settled', event)
 
+    def on_transport_closed(self, event):
+        spans = getattr(event.connection, 'delivery_spans', None)
+        if spans is not None:
+            spans.close()
+        _forget_link_tracing(event.connection)
+
 class Sender(ProtonSender):
     def send(self, msg):
         tracer = get_tracer()
-        connection = self.connection
-        span_tags = {
-            tags.SPAN_KIND: tags.SPAN_KIND_PRODUCER,
-            tags.MESSAGE_BUS_DESTINATION: self.target.address,
-            tags.PEER_ADDRESS: connection.connected_address,
-            tags.PEER_HOSTNAME: connection.hostname,
-            'inserted_by': 'proton-message-tracing'
-        }
-        span = tracer.start_span('amqp-delivery-send', tags=span_tags)
-        headers = {}
-        tracer.inject(span, Format.TEXT_MAP, headers)
+        link_tracing = getattr(self, 'tracing', None)
+        if link_tracing is None:
+            link_tracing = _link_tracing(self, self.target.address, tags.SPAN_KIND_PRODUCER)
+        if _transit is not None:
+            stamp_sent(msg)
+        if not link_tracing.trace:
+            return ProtonSender.send(self, msg)
+        if link_tracing.batch_interval:
+            return self._send_batched(tracer, link_tracing, msg)
+        parent = tracer.active_span
+        if parent is None:
+            trace_id, sampler_tags = _sample_root(tracer, link_tracing)
+            if sampler_tags is None:
+                return self._send_unsampled(tracer, msg, trace_id)
+        elif not parent.context.flags & SAMPLED_FLAG:
+            return self._send_unsampled(tracer, msg, parent=parent.context)
+        if parent is None:
+            span = _start_root_span(tracer, 'amqp-delivery-send', trace_id, sampler_tags, link_tracing.span_tags)
+        else:
+            span = tracer.start_span('amqp-delivery-send', child_of=parent, tags=link_tracing.span_tags)
+        _send_spans.inc()
+        start = time.perf_counter()
+        headers = _encoding.inject(tracer, span.context, _trace_encoding)
+        _inject_time.record(time.perf_counter() - start)
         if msg.annotations is None:
             msg.annotations = { _trace_key: headers }
         else:
             msg.annotations[_trace_key] = headers
         delivery = ProtonSender.send(self, msg)
-        delivery.span = span
         span.set_tag('delivery-tag', delivery.tag)
+        if delivery.settled:
+            span.set_tag('delivery-terminal-state', 'PRESETTLED')
+            span.finish()
+        else:
+            delivery.span = span
+            _delivery_spans(self.connection).add(span)
         return delivery
 
-# Monkey patch proton for tracing (need to patch both internal and external names)
-proton._handlers.IncomingMessageHandler = IncomingMessageHandler
-proton._handlers.OutgoingMessageHandler = OutgoingMessageHandler
-proton._endpoints.Sender = Sender
-proton.handlers.IncomingMessageHandler = IncomingMessageHandler
-proton.handlers.OutgoingMessageHandler = OutgoingMessageHandler
-proton.Sender = Sender
+    def _send_unsampled(self, tracer, msg, trace_id=None, parent=None):
+        annotations = msg.annotations
+        if annotations is not None:
+            flags = _encoding.trace_flags(annotations.get(_trace_key))
+            if flags is not None and not flags & SAMPLED_FLAG:
+                # Left alone when forwarding a message already marked, so a
+                # RawMessage is sent as received
+                return ProtonSender.send(self, msg)
+        headers = _encoding.inject(tracer, _unsampled_context(tracer, trace_id, parent), _trace_encoding)
+        if annotations is None:
+            msg.annotations = { _trace_key: headers }
+        else:
+            annotations[_trace_key] = headers
+        return ProtonSender.send(self, msg)
+
+    def _send_batched(self, tracer, link_tracing, msg):
+        batch = link_tracing.batch
+        if batch is not None and not batch.closed and time.monotonic() >= batch.deadline:
+            batch.close()
+        if batch is None or batch.closed:
+            link_tracing.batch = None
+            parent = tracer.active_span
+            if parent is None:
+                trace_id, sampler_tags = _sample_root(tracer, link_tracing)
+                if sampler_tags is None:
+                    return self._send_unsampled(tracer, msg, trace_id)
+            elif not parent.context.flags & SAMPLED_FLAG:
+                return self._send_unsampled(tracer, msg, parent=parent.context)
+            if parent is None:
+                span = _start_root_span(tracer, 'amqp-delivery-send-batch', trace_id, sampler_tags,
+                                        link_tracing.span_tags)
+            else:
+                span = tracer.start_span('amqp-delivery-send-batch', child_of=parent, tags=link_tracing.span_tags)
+            _send_spans.inc()
+            start = time.perf_counter()
+            headers = _encoding.inject(tracer, span.context, _trace_encoding)
+            _inject_time.record(time.perf_counter() - start)
+            batch = SendBatch(span, headers, link_tracing.batch_interval, link_tracing.batches)
+            link_tracing.batch = batch
+            # The batch ends on its first send after the deadline, or when this timer fires
+            container = getattr(self.connection.transport, '_reactor', None)
+            if container is not None:
+                container.schedule(link_tracing.batch_interval, batch)
+        if msg.annotations is None:
+            msg.annotations = { _trace_key: batch.headers }
+        else:
+            msg.annotations[_trace_key] = batch.headers
+        delivery = ProtonSender.send(self, msg)
+        batch.add(delivery, delivery.pending)
+        if not delivery.settled:
+            delivery.batch = batch
+        return delivery
+
+def _abort(delivery):
+    # Finishes the delivery's span, or counts it in its batch, as aborted:
+    # its settlement is not reported after that
+    span = getattr(delivery, 'span', None)
+    if span is not None:
+        delivery.span = None
+        if _delivery_spans(delivery.link.connection).remove(span):
+            span.set_tag('delivery-terminal-state', DeliverySpans.ABORTED)
+            span.log_kv({'event': 'delivery aborted'})
+            span.finish()
+    batch = getattr(delivery, 'batch', None)
+    if batch is not None:
+        delivery.batch = None
+        batch.settled(DeliverySpans.ABORTED)
+    _originals[3](delivery)
+
+_originals = None
+
+def install():
+    """
+    Replace the proton sender and message handlers with the tracing ones
+    (need to patch both internal and external names), and trace deliveries
+    being aborted
+    """
+    global _originals
+    if _originals is not None:
+        return
+    _originals = (ProtonIncomingMessageHandler, ProtonOutgoingMessageHandler, ProtonSender, Delivery.abort)
+    proton._handlers.IncomingMessageHandler = IncomingMessageHandler
+    proton._handlers.OutgoingMessageHandler = OutgoingMessageHandler
+    proton._endpoints.Sender = Sender
+    proton.handlers.IncomingMessageHandler = IncomingMessageHandler
+    proton.handlers.OutgoingMessageHandler = OutgoingMessageHandler
+    proton.Sender = Sender
+    Delivery.abort = _abort
+
+def uninstall():
+    """
+    Put the original proton classes back
+    """
+    global _originals
+    if _originals is None:
+        return
+    incoming, outgoing, sender, abort = _originals
+    proton._handlers.IncomingMessageHandler = incoming
+    proton._handlers.OutgoingMessageHandler = outgoing
+    proton._endpoints.Sender = sender
+    proton.handlers.IncomingMessageHandler = incoming
+    proton.handlers.OutgoingMessageHandler = outgoing
+    proton.Sender = sender
+    Delivery.abort = abort
+    _originals = None
@@ -0,0 +1,143 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+"""
+Transit timestamps carried in the message annotations.
+
+A message sent with transit stamping on carries a list of the times, in
+microseconds since the epoch, it was sent and then passed each stamping hop
+(a broker queueing and dequeuing it). It is a separate annotation from the
+trace context so that every message can carry it, sampled or not, and the
+context encodings stay as they are.
+"""
+
+import time
+
+from proton import symbol
+
+from ._histogram import Histogram
+
+TRANSIT_KEY = symbol('x-opt-qpid-transit')
+
+
+def _now():
+    return int(time.time() * 1e6)
+
+
+def stamp_sent(message):
+    """
+    Start the message's timestamps with the time now, unless it already has
+    some (being forwarded)
+    """
+    annotations = message.annotations
+    if annotations is None:
+        message.annotations = {TRANSIT_KEY: [_now()]}
+    elif TRANSIT_KEY not in annotations:
+        annotations[TRANSIT_KEY] = [_now()]
+
+
+def stamp_transit(message):
+    """
+    Add the time now to the timestamps of a message carrying them, as an
+    intermediary does when it queues and dequeues the message; messages
+    without are left alone.
+
+    :return: True if the message was stamped
+    """
+    annotations = message.annotations
+    if not annotations:
+        return False
+    stamps = annotations.get(TRANSIT_KEY)
+    if not isinstance(stamps, list):
+        return False
+    # Assigned rather than appended so that a RawMessage sees the change
+    annotations[TRANSIT_KEY] = stamps + [_now()]
+    return True
+
+
+class AddressTransit(object):
+    """
+    Latency histograms of the messages received from one address
+    """
+    __slots__ = ('transit', 'hops')
+
+    def __init__(self):
+        self.transit = Histogram()
+        self.hops = []
+
+
+class TransitLatency(object):
+    """
+    Latency of received messages from their transit timestamps: the transit
+    time from being sent to being received, overall and per address, and
+    per address the time taken by each hop. Hop ``n`` runs from timestamp
+    ``n`` to the next, the last to the message being received; through the
+    example broker hop 0 is sender to queue, hop 1 the time queued and hop 2
+    broker to receiver.
+
+    Times between processes on different hosts include the difference
+    between their clocks; negative times are counted as zero.
+
+    :param max_hops: hops recorded per address, later ones are ignored
+    :param registry: optional :class:`proton_tracing.Metrics` to publish the
+        overall transit time and the count of unreadable timestamps to
+    """
+    def __init__(self, max_hops=8, registry=None):
+        self.max_hops = max_hops
+        self.addresses = {}
+        self.invalid = 0
+        if registry is None:
+            self.transit = Histogram()
+        else:
+            self.transit = registry.histogram('proton_tracing_transit_seconds',
+                                              'Time from messages being sent to being received')
+            registry.counter('proton_tracing_transit_invalid_total',
+                             'Received messages with unreadable transit timestamps', lambda: self.invalid)
+
+    def record(self, address, stamps, now=None):
+        if now is None:
+            now = _now()
+        if not isinstance(stamps, list):
+            self.invalid += 1
+            return
+        try:
+            latency = (now - stamps[0]) * 1e-6
+            a = self.addresses.get(address)
+            if a is None:
+                a = self.addresses[address] = AddressTransit()
+            hops = a.hops
+            times = stamps + [now]
+            for i in range(min(len(stamps), self.max_hops)):
+                if i == len(hops):
+                    hops.append(Histogram())
+                hops[i].record((times[i + 1] - times[i]) * 1e-6)
+        except (IndexError, TypeError):
+            self.invalid += 1
+            return
+        self.transit.record(latency)
+        a.transit.record(latency)
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """
+        :return: {address: {'transit': summary, 'hops': [summary, ...]}}
+            of the :meth:`Histogram.summary` of each histogram
+        """
+        return dict((address, {'transit': a.transit.summary(percentiles),
+                               'hops': [h.summary(percentiles) for h in a.hops]})
+                    for address, a in list(self.addresses.items()))
@@ -0,0 +1,272 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+import collections
+import mmap
+import os
+import struct
+import tempfile
+
+from opentracing.propagation import Format
+
+from proton import Message
+
+# Stand in for the (already finished) queue span of a message read back from
+# disk: dispatch only needs its context to refer to it
+SpanReference = collections.namedtuple('SpanReference', ['context'])
+
+# record length, enqueue time, expiry time (0 for none), length of queue span context
+_header = struct.Struct('!IddH')
+
+
+class _Segment(object):
+    """
+    Fixed size memory mapped file holding a run of message records
+    """
+    def __init__(self, directory, size):
+        fd, self.path = tempfile.mkstemp(prefix='queue-', suffix='.seg', dir=directory)
+        self.file = os.fdopen(fd, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.size = size
+        self.write_offset = 0
+        self.read_offset = 0
+        self.count = 0
+
+    def fits(self, length):
+        return self.write_offset + length <= self.size
+
+    def append(self, record):
+        end = self.write_offset + len(record)
+        self.map[self.write_offset:end] = record
+        self.write_offset = end
+        self.count += 1
+
+    def read(self):
+        start = self.read_offset
+        length, enqueued, expires, context_length = _header.unpack_from(self.map, start)
+        offset = start + _header.size
+        context = self.map[offset:offset + context_length]
+        offset += context_length
+        data = self.map[offset:start + length]
+        self.read_offset = start + length
+        self.count -= 1
+        return enqueued, expires or None, context, data
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        os.unlink(self.path)
+
+
+class SpillQueue(object):
+    """
+    FIFO of messages keeping at most ``memory_limit`` decoded messages in
+    memory and spilling the rest, encoded with their annotations, to memory
+    mapped segment files in ``directory``.
+
+    Once spilling starts every new message goes to disk until the consumers
+    have caught up, so ordering is preserved. Spilled messages are read back
+    ``reload_batch`` at a time when the in memory head runs dry and each
+    segment file is removed as soon as it has been read.
+
+    Supports the subset of the deque interface used by the broker Queue.
+
+    :param message_type: class of the messages queued, used to decode them
+        when they are read back
+    """
+    def __init__(self, tracer, directory=None, memory_limit=10000, segment_size=16*1024*1024,
+                 reload_batch=256, message_type=Message):
+        self.tracer = tracer
+        self.message_type = message_type
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.segment_size = segment_size
+        self.reload_batch = reload_batch
+        self.head = collections.deque()
+        self.segments = collections.deque()
+        self.spilled = 0
+
+    def __len__(self):
+        return len(self.head) + self.spilled
+
+    def __bool__(self):
+        return bool(self.head) or self.spilled > 0
+
+    def append(self, message):
+        if self.spilled == 0 and len(self.head) < self.memory_limit:
+            self.head.append(message)
+        else:
+            self._spill(message)
+
+    def popleft(self):
+        if not self.head and self.spilled:
+            self._reload()
+        return self.head.popleft()
+
+    def close(self):
+        for s in self.segments:
+            s.close()
+        self.segments.clear()
+        self.head.clear()
+        self.spilled = 0
+
+    def _spill(self, message):
+        context = bytearray()
+        qspan = getattr(message, 'qspan', None)
+        if qspan is not None:
+            self.tracer.inject(qspan.context, Format.BINARY, context)
+        data = message.encode()
+        length = _header.size + len(context) + len(data)
+        record = _header.pack(length, getattr(message, 'enqueued', 0.0), getattr(message, 'expires', None) or 0.0,
+                              len(context)) + context + data
+        if not self.segments or not self.segments[-1].fits(length):
+            self.segments.append(_Segment(self.directory, max(self.segment_size, length)))
+        self.segments[-1].append(record)
+        self.spilled += 1
+
+    def _reload(self):
+        while self.segments and len(self.head) < self.reload_batch:
+            segment = self.segments[0]
+            while segment.count and len(self.head) < self.reload_batch:
+                enqueued, expires, context, data = segment.read()
+                message = self.message_type()
+                message.decode(data)
+                message.enqueued = enqueued
+                message.expires = expires
+                if context:
+                    message.qspan = SpanReference(self.tracer.extract(Format.BINARY, bytearray(context)))
+                else:
+                    message.qspan = None
+                self.head.append(message)
+                self.spilled -= 1
+            if not segment.count:
+                self.segments.popleft().close()
+
+
+class Fifo(object):
+    """
+    In memory FIFO of messages from which any message can also be taken out
+    in O(1), by the key :meth:`append` returned for it.
+
+    Supports the subset of the deque interface used by the broker Queue.
+    """
+    def __init__(self):
+        self.messages = collections.OrderedDict()
+        self.next_key = 0
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __bool__(self):
+        return bool(self.messages)
+
+    def append(self, message):
+        """
+        :return: the key to :meth:`remove` the message by
+        """
+        key = self.next_key
+        self.next_key += 1
+        self.messages[key] = message
+        return key
+
+    def popleft(self):
+        return self.messages.popitem(last=False)[1]
+
+    def remove(self, key):
+        """
+        :return: the message, or None if it has already gone
+        """
+        return self.messages.pop(key, None)
+
+    def close(self):
+        self.messages.clear()
+
+
+class PriorityQueue(object):
+    """
+    Messages taken highest AMQP priority first and in order within each
+    priority, from a store per priority level (0 to 9) made by ``new_store``
+    the first time a message of that priority is queued. Appending and
+    taking a message are O(1) as there are only ten levels.
+
+    Messages in a :class:`Fifo` level can be taken out of the middle with
+    the token :meth:`append` returns for them; other stores, such as a
+    :class:`SpillQueue`, give no token.
+    """
+    LEVELS = 10
+
+    def __init__(self, new_store=Fifo):
+        self.new_store = new_store
+        self.levels = [None] * self.LEVELS
+        # Highest level that may hold messages
+        self.top = -1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def append(self, message, priority=4):
+        """
+        :return: a token to :meth:`remove` the message by, or None
+        """
+        level = min(max(priority, 0), self.LEVELS - 1)
+        store = self.levels[level]
+        if store is None:
+            store = self.levels[level] = self.new_store()
+        key = store.append(message)
+        self.length += 1
+        if level > self.top:
+            self.top = level
+        return None if key is None else (level, key)
+
+    def popleft(self):
+        levels = self.levels
+        while self.top >= 0 and not levels[self.top]:
+            self.top -= 1
+        if self.top < 0:
+            raise IndexError('pop from an empty queue')
+        self.length -= 1
+        return levels[self.top].popleft()
+
+    def remove(self, token):
+        """
+        :return: the message, or None if it has already been taken or the
+            queue closed
+        """
+        level, key = token
+        store = self.levels[level]
+        if store is None:
+            return None
+        message = store.remove(key)
+        if message is not None:
+            self.length -= 1
+        return message
+
+    def close(self):
+        for store in self.levels:
+            if store is not None:
+                store.close()
+        self.levels = [None] * self.LEVELS
+        self.top = -1
+        self.length = 0
@@ -0,0 +1,192 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import struct
+
+from proton import Data, Described, Link, ulong
+
+# Section descriptor codes, in the order the sections appear in a message
+HEADER = 0x70
+DELIVERY_ANNOTATIONS = 0x71
+MESSAGE_ANNOTATIONS = 0x72
+PROPERTIES = 0x73
+
+_size32 = struct.Struct('!I')
+_ulong = struct.Struct('!Q')
+
+
+def _skip(data, pos):
+    """
+    :return: the offset just after the AMQP encoded value at pos
+    """
+    code = data[pos]
+    pos += 1
+    if code == 0x00:
+        # Described: descriptor then value
+        return _skip(data, _skip(data, pos))
+    width = code >> 4
+    if width == 0x4:
+        return pos
+    if width <= 0x9:
+        return pos + (1, 2, 4, 8, 16)[width - 0x5]
+    if width in (0xa, 0xc, 0xe):
+        return pos + 1 + data[pos]
+    return pos + 4 + _size32.unpack_from(data, pos)[0]
+
+
+def _sections(data):
+    """
+    :return: list of (descriptor code, start, end) for each section
+    """
+    sections = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        if data[pos] != 0x00:
+            raise ValueError('not an AMQP message section at offset %d' % pos)
+        if data[pos + 1] == 0x53:
+            code = data[pos + 2]
+        elif data[pos + 1] == 0x80:
+            code = _ulong.unpack_from(data, pos + 2)[0]
+        else:
+            raise ValueError('unexpected section descriptor at offset %d' % pos)
+        next = _skip(data, pos)
+        sections.append((code, pos, next))
+        pos = next
+    return sections
+
+
+def _decode_section(data):
+    d = Data()
+    d.decode(bytes(data))
+    d.rewind()
+    d.next()
+    return d.get_object().value
+
+
+class _Annotations(dict):
+    """
+    Message annotations remembering whether they have been changed
+    """
+    changed = False
+
+    def __setitem__(self, key, value):
+        self.changed = True
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self.changed = True
+        dict.__delitem__(self, key)
+
+
+class RawMessage(object):
+    """
+    A message kept as it was received, encoded.
+
+    Only the message annotations (holding the trace context) and, on
+    request, the ``to`` address and the header are ever decoded. Sending streams the
+    received bytes unchanged, or if the annotations were changed, the
+    received bytes either side of a newly encoded annotations section, so
+    the cost does not depend on the size of the body. It can be sent with
+    ``sender.send()`` like a :class:`proton.Message`.
+    """
+    def __init__(self, data=None):
+        if data is not None:
+            self.decode(data)
+
+    def decode(self, data):
+        self.data = memoryview(data)
+        self._sections = None
+        self._annotations = None
+        self._header = None
+
+    def _section(self, code):
+        """
+        :return: (start, end) of the section, or an empty range where it would go
+        """
+        if self._sections is None:
+            self._sections = _sections(self.data)
+        for c, start, end in self._sections:
+            if c == code:
+                return start, end
+            if c > code:
+                return start, start
+        return len(self.data), len(self.data)
+
+    @property
+    def annotations(self):
+        if self._annotations is None:
+            start, end = self._section(MESSAGE_ANNOTATIONS)
+            if start == end:
+                return None
+            self._annotations = _Annotations(_decode_section(self.data[start:end]))
+        return self._annotations
+
+    @annotations.setter
+    def annotations(self, value):
+        self._annotations = _Annotations(value or {})
+        self._annotations.changed = True
+
+    def _header_field(self, index):
+        if self._header is None:
+            start, end = self._section(HEADER)
+            self._header = _decode_section(self.data[start:end]) if start != end else []
+        return self._header[index] if len(self._header) > index else None
+
+    @property
+    def priority(self):
+        priority = self._header_field(1)
+        return 4 if priority is None else priority
+
+    @property
+    def ttl(self):
+        """
+        Time to live in seconds, 0 for none, as for :class:`proton.Message`
+        """
+        ttl = self._header_field(2)
+        return ttl / 1000.0 if ttl else 0.0
+
+    @property
+    def address(self):
+        start, end = self._section(PROPERTIES)
+        if start == end:
+            return None
+        properties = _decode_section(self.data[start:end])
+        return properties[2] if len(properties) > 2 else None
+
+    def encode(self):
+        return b''.join(self._parts())
+
+    def _parts(self):
+        annotations = self._annotations
+        if annotations is None or not annotations.changed:
+            return [self.data]
+        start, end = self._section(MESSAGE_ANNOTATIONS)
+        d = Data()
+        d.put_object(Described(ulong(MESSAGE_ANNOTATIONS), dict(annotations)))
+        return [self.data[:start], d.encode(), self.data[end:]]
+
+    def send(self, sender, tag=None):
+        dlv = sender.delivery(tag or sender.delivery_tag())
+        for part in self._parts():
+            sender.stream(part)
+        sender.advance()
+        if sender.snd_settle_mode == Link.SND_SETTLED:
+            dlv.settle()
+        return dlv
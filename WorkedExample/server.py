@@ -18,21 +18,47 @@
 # under the License.
 #
 
+import concurrent.futures
 import optparse
 
 from proton import Message, Url
 from proton.handlers import MessagingHandler
-from proton.reactor import Container
-from proton.tracing import init_tracer
+from proton.reactor import ApplicationEvent, Container, EventInjector
+import proton_tracing
+from proton_tracing import init_tracer, tracer
 
-tracer = init_tracer('server')
+from client_common import follow_redirect
+from flow_control import AdaptiveFlowController
+
+
+def process_request(request):
+    return request.upper()
+
+
+def _traced(span, request):
+    # Runs on a pool thread: make the request span active there too
+    with tracer.scope_manager.activate(span, False):
+        return process_request(request)
 
 
 class Server(MessagingHandler):
-    def __init__(self, url, address):
-        super(Server, self).__init__()
+    """
+    :param pool: optional ``concurrent.futures`` executor; requests are then
+        processed on it and the replies sent back on the container thread
+    :param credit: if set, the fixed credit window for requests; otherwise
+        it is sized by an :class:`AdaptiveFlowController`, counting requests
+        still on the pool against it
+    """
+    def __init__(self, url, address, pool=None, credit=0):
+        super(Server, self).__init__(prefetch=credit)
         self.url = url
         self.address = address
+        self.pool = pool
+        self.pending = 0
+        self.flow_control = None
+        if not credit:
+            self.flow_control = AdaptiveFlowController(backlog=lambda link: self.pending,
+                                                       registry=proton_tracing.metrics, name='server').install(self)
 
     def on_start(self, event):
         print("Listening on", self.url)
@@ -40,27 +66,98 @@ class Server(MessagingHandler):
         self.conn = event.container.connect(self.url)
         self.receiver = event.container.create_receiver(self.conn, self.address)
         self.server = self.container.create_sender(self.conn, None)
+        if self.pool is not None:
+            self.injector = EventInjector()
+            self.container.selectable(self.injector)
+
+    def on_link_error(self, event):
+        receiver = follow_redirect(event)
+        if receiver is None:
+            super(Server, self).on_link_error(event)
+        else:
+            # Replies are still sent on the anonymous sender of the first connection
+            self.receiver = receiver
 
     def on_message(self, event):
         print("Received", event.message)
+        if self.pool is not None:
+            self.submit(event.message)
+            return
         request = event.message.body
         tags = {'request': request}
         with tracer.start_active_span('process-request', tags = tags) as scope:
-            response = event.message.body.upper()
+            response = process_request(request)
             msg = Message(address=event.message.reply_to, body=response,
                           correlation_id=event.message.correlation_id)
             scope.span.log_kv({'result': response})
         self.server.send(msg)
 
+    def submit(self, request):
+        self.pending += 1
+        parent = tracer.active_span
+        span = tracer.start_span('process-request', child_of=parent, tags={'request': request.body})
+        if isinstance(self.pool, concurrent.futures.ThreadPoolExecutor):
+            future = self.pool.submit(_traced, span, request.body)
+        else:
+            # The span can't follow the request into another process
+            future = self.pool.submit(process_request, request.body)
+        future.add_done_callback(
+            lambda f: self.injector.trigger(ApplicationEvent('request_done', subject=(request, parent, span, f))))
+
+    def on_request_done(self, event):
+        request, parent, span, future = event.subject
+        self.pending -= 1
+        if self.flow_control is not None:
+            self.flow_control.replenish(self.receiver)
+        try:
+            response = future.result()
+            span.log_kv({'result': response})
+        except Exception as e:
+            response = 'error: %s' % e
+            span.set_tag('error', True)
+            span.log_kv({'event': 'error', 'error.object': e})
+        span.finish()
+        msg = Message(address=request.reply_to, body=response, correlation_id=request.correlation_id)
+        if parent is None:
+            self.server.send(msg)
+        else:
+            with tracer.scope_manager.activate(parent, False):
+                self.server.send(msg)
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-a", "--address", default="localhost:5672/examples",
+                      help="address from which messages are received (default %default)")
+    parser.add_option("-w", "--workers", type="int", default=0,
+                      help="number of pool workers processing requests; 0 processes them on the container thread (default %default)")
+    parser.add_option("-p", "--processes", action="store_true", default=False,
+                      help="use a pool of processes rather than threads")
+    parser.add_option("-c", "--credit", type="int", default=0,
+                      help="fixed credit window for requests; 0 sizes it to how fast they are processed (default %default)")
+    parser.add_option("-T", "--tail-latency", type="float", default=None,
+                      help="only export traces with a span slower than this many seconds or a failed delivery (default: export all)")
+    opts, args = parser.parse_args()
+
+    if opts.tail_latency is not None and proton_tracing.enabled():
+        init_tracer('server', sampler=proton_tracing.ConstSampler(True),
+                    reporter=proton_tracing.TailSamplingReporter(latency_threshold=opts.tail_latency))
+    else:
+        init_tracer('server')
+
+    url = Url(opts.address)
+    pool = None
+    if opts.workers:
+        if opts.processes:
+            pool = concurrent.futures.ProcessPoolExecutor(opts.workers)
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(opts.workers)
 
-parser = optparse.OptionParser(usage="usage: %prog [options]")
-parser.add_option("-a", "--address", default="localhost:5672/examples",
-                  help="address from which messages are received (default %default)")
-opts, args = parser.parse_args()
+    try:
+        Container(Server(url, url.path, pool, opts.credit)).run()
+    except KeyboardInterrupt:
+        pass
 
-url = Url(opts.address)
 
-try:
-    Container(Server(url, url.path)).run()
-except KeyboardInterrupt:
-    pass
+if __name__ == '__main__':
+    main()
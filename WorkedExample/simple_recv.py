@@ -23,12 +23,19 @@ import optparse
 from proton.handlers import MessagingHandler
 from proton.reactor import Container
 
-import proton.tracing
+import proton_tracing
+
+from client_common import follow_redirect
+from flow_control import AdaptiveFlowController
 
 
 class Recv(MessagingHandler):
-    def __init__(self, url, count):
-        super(Recv, self).__init__()
+    def __init__(self, url, count, credit=0, transit=None):
+        super(Recv, self).__init__(prefetch=credit)
+        # Records the transit timestamps here when tracing is not there to do it
+        self.transit = transit
+        if not credit:
+            AdaptiveFlowController(registry=proton_tracing.metrics, name='receiver').install(self)
         self.url = url
         self.expected = count
         self.received = 0
@@ -36,7 +43,15 @@ class Recv(MessagingHandler):
     def on_start(self, event):
         event.container.create_receiver(self.url)
 
+    def on_link_error(self, event):
+        if follow_redirect(event) is None:
+            super(Recv, self).on_link_error(event)
+
     def on_message(self, event):
+        if self.transit is not None and event.message.annotations:
+            stamps = event.message.annotations.get(proton_tracing.TRANSIT_KEY)
+            if stamps is not None:
+                self.transit.record(event.receiver.source.address, stamps)
         if event.message.id and event.message.id < self.received:
             # ignore duplicate message
             return
@@ -53,9 +68,29 @@ parser.add_option("-a", "--address", default="localhost:5672/examples",
                   help="address from which messages are received (default %default)")
 parser.add_option("-m", "--messages", type="int", default=100,
                   help="number of messages to receive; 0 receives indefinitely (default %default)")
+parser.add_option("-c", "--credit", type="int", default=0,
+                  help="fixed credit window; 0 sizes it to how fast messages are processed (default %default)")
+parser.add_option("-t", "--transit", action="store_true", default=False,
+                  help="print the transit latency of messages sent with simple_send.py -t when done")
 opts, args = parser.parse_args()
 
+transit = None
+if opts.transit:
+    if proton_tracing.enabled():
+        proton_tracing.init_tracer('simple_recv', transit=True)
+    else:
+        transit = proton_tracing.TransitLatency()
+
 try:
-    Container(Recv(opts.address, opts.messages)).run()
+    Container(Recv(opts.address, opts.messages, opts.credit, transit)).run()
 except KeyboardInterrupt:
     pass
+
+if opts.transit:
+    if transit is None:
+        transit = proton_tracing.transit_latency()
+    for address, latency in sorted(transit.summary((50, 99)).items()):
+        print("%s transit p50 %.0f us p99 %.0f us" % (address, latency['transit']['p50'] * 1e6,
+                                                      latency['transit']['p99'] * 1e6))
+        for n, hop in enumerate(latency['hops']):
+            print("%s hop %d p50 %.0f us p99 %.0f us" % (address, n, hop['p50'] * 1e6, hop['p99'] * 1e6))
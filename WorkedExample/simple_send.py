@@ -24,13 +24,17 @@ from proton import Message
 from proton.handlers import MessagingHandler
 from proton.reactor import Container
 
-import proton.tracing
+import proton_tracing
+
+from client_common import follow_redirect
 
 
 class Send(MessagingHandler):
-    def __init__(self, url, messages):
+    def __init__(self, url, messages, stamp=False):
         super(Send, self).__init__()
         self.url = url
+        # Stamp the messages here when tracing is not there to do it
+        self.stamp = stamp
         self.sent = 0
         self.confirmed = 0
         self.total = messages
@@ -38,9 +42,15 @@ class Send(MessagingHandler):
     def on_start(self, event):
         event.container.create_sender(self.url)
 
+    def on_link_error(self, event):
+        if follow_redirect(event) is None:
+            super(Send, self).on_link_error(event)
+
     def on_sendable(self, event):
         while event.sender.credit and self.sent < self.total:
             msg = Message(id=(self.sent + 1), body={'sequence': (self.sent + 1)})
+            if self.stamp:
+                proton_tracing.stamp_sent(msg)
             event.sender.send(msg)
             self.sent += 1
 
@@ -60,10 +70,20 @@ parser.add_option("-a", "--address", default="localhost:5672/examples",
                   help="address to which messages are sent (default %default)")
 parser.add_option("-m", "--messages", type="int", default=100,
                   help="number of messages to send (default %default)")
+parser.add_option("-b", "--batch", type="float", default=None,
+                  help="trace the messages sent in each period of this many seconds with one batch span (default: a span per message)")
+parser.add_option("-t", "--transit", action="store_true", default=False,
+                  help="stamp each message with its send time for the receiver's transit latency")
 opts, args = parser.parse_args()
 
+if opts.batch:
+    proton_tracing.init_tracer('simple_send', policies=[('*', proton_tracing.TracePolicy(batch=opts.batch))],
+                               transit=opts.transit)
+elif opts.transit:
+    proton_tracing.init_tracer('simple_send', transit=True)
+
 try:
-    Container(Send(opts.address, opts.messages)).run()
+    Container(Send(opts.address, opts.messages, opts.transit and not proton_tracing.enabled())).run()
 
 except KeyboardInterrupt:
     pass
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+
+"""
+Per-hop message latency from the span files written by
+proton_tracing.FileReporter.
+
+Spans from all the files given (the directories of every process in the
+flow) are joined on their parent ids. Each message received by a client is
+traced back through the broker, if it went through one:
+
+  amqp-delivery-send            sent by the producer
+  amqp-delivery-receive         received by the broker
+  queue-message                 put on the queue
+  dequeue-message               taken off the queue for a consumer
+  amqp-delivery-send            sent on by the broker
+  amqp-delivery-receive         received by the consumer
+
+and the time between the starts of these spans is reported as the hops
+to-broker (sending to queueing), queued, to-consumer (dequeuing to
+receipt) and end-to-end, with percentiles for each address. Messages sent
+directly have only an end-to-end time. The hops between processes on
+different hosts include the difference between their clocks.
+
+Needs numpy.
+"""
+
+import glob
+import json
+import optparse
+import os
+import struct
+import sys
+
+import numpy as np
+
+# Must match proton_tracing/_file.py
+MAGIC = b'PTSPANS\0'
+HEADER = struct.Struct('<8sII')
+RECORD = np.dtype([('trace_id_high', '<u8'), ('trace_id', '<u8'), ('span_id', '<u8'), ('parent_id', '<u8'),
+                   ('start', '<i8'), ('duration', '<u4'), ('operation', '<u2'), ('address', '<u2'),
+                   ('state', '<u2'), ('flags', '<u2')])
+STRING_FIELDS = ('operation', 'address', 'state')
+# Records once loaded: the combined string table of many segments may need
+# more than 16 bits
+LOADED = np.dtype([(name, '<u4' if name in STRING_FIELDS else RECORD[name]) for name in RECORD.names])
+
+SENDS = ('amqp-delivery-send', 'amqp-delivery-send-batch')
+HOPS = ('to-broker', 'queued', 'to-consumer', 'end-to-end')
+
+
+class Spans(object):
+    """
+    The spans of a set of span files, as one record array (of ``LOADED``
+    records) whose string fields index ``strings``
+    """
+    def __init__(self, records, strings):
+        self.records = records
+        self.strings = strings
+        self._index = {s: i for i, s in enumerate(strings)}
+        ids = records['span_id']
+        self._order = np.argsort(ids, kind='stable')
+        self._sorted_ids = ids[self._order]
+
+    @classmethod
+    def load(cls, paths):
+        """
+        Read every .spans file in paths, which may be files or directories
+        """
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(glob.glob(os.path.join(path, '*.spans'))))
+            else:
+                files.append(path)
+        strings = []
+        index = {}
+        parts = []
+        for name in files:
+            with open(name, 'rb') as f:
+                header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                continue
+            magic, version, size = HEADER.unpack(header)
+            if magic != MAGIC or size != RECORD.itemsize:
+                raise ValueError('%s is not a span file this tool can read' % name)
+            # The file may still be being written, so ignore a partial record
+            count = (os.path.getsize(name) - HEADER.size) // RECORD.itemsize
+            records = np.fromfile(name, dtype=RECORD, count=count, offset=HEADER.size).astype(LOADED)
+            with open(os.path.splitext(name)[0] + '.strings', encoding='utf-8') as f:
+                local = [json.loads(line) for line in f]
+            # Renumber the segment's strings into the combined table
+            remap = np.empty(max(len(local), 1), dtype=LOADED['operation'])
+            for i, s in enumerate(local):
+                if s not in index:
+                    index[s] = len(strings)
+                    strings.append(s)
+                remap[i] = index[s]
+            for field in STRING_FIELDS:
+                records[field] = remap[records[field]]
+            parts.append(records)
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=LOADED)
+        return cls(records, strings)
+
+    def code(self, s):
+        """
+        The index of string s, or -1 if no span uses it
+        """
+        return self._index.get(s, -1)
+
+    def operation(self, *names):
+        """
+        Mask of the spans with one of the operation names
+        """
+        return np.isin(self.records['operation'], [self.code(n) for n in names])
+
+    def parent(self, rows):
+        """
+        Rows of the parents of the spans at rows, -1 where the parent was not recorded
+        """
+        rows = np.asarray(rows)
+        result = np.full(rows.shape, -1, dtype=np.int64)
+        valid = rows >= 0
+        if not len(self._sorted_ids):
+            return result
+        r = self.records[rows[valid]]
+        pos = np.minimum(np.searchsorted(self._sorted_ids, r['parent_id']), len(self._sorted_ids) - 1)
+        found = self._order[pos]
+        ok = ((self._sorted_ids[pos] == r['parent_id']) & (r['parent_id'] != 0) &
+              (self.records['trace_id'][found] == r['trace_id']))
+        result[valid] = np.where(ok, found, -1)
+        return result
+
+
+def _is(rows, mask):
+    # mask[rows] with rows of -1 false
+    return (rows >= 0) & mask[np.maximum(rows, 0)]
+
+
+def hops(spans):
+    """
+    The latency hops of every message received by a client
+
+    :return: (addresses, {hop: microseconds}), arrays with one entry per
+        message and NaN for hops a message did not take
+    """
+    records = spans.records
+    start = records['start']
+    receive = spans.operation('amqp-delivery-receive')
+    send = spans.operation(*SENDS)
+    queue = spans.operation('queue-message')
+    dequeue = spans.operation('dequeue-message')
+
+    # The broker's own receives are the parents of its queue spans
+    queued_from = np.zeros(len(records), dtype=bool)
+    parents = spans.parent(np.flatnonzero(queue))
+    queued_from[parents[parents >= 0]] = True
+    final = np.flatnonzero(receive & ~queued_from)
+
+    sent = spans.parent(final)
+    keep = _is(sent, send)
+    final, sent = final[keep], sent[keep]
+
+    dq = spans.parent(sent)
+    q = spans.parent(dq)
+    broker_receive = spans.parent(q)
+    origin = spans.parent(broker_receive)
+    brokered = (_is(dq, dequeue) & _is(q, queue) & _is(broker_receive, receive) &
+                _is(origin, send))
+    origin = np.where(brokered, origin, sent)
+
+    def elapsed(later, earlier, valid):
+        return np.where(valid, start[np.maximum(later, 0)] - start[np.maximum(earlier, 0)], np.nan)
+
+    result = {
+        'to-broker': elapsed(q, origin, brokered),
+        'queued': elapsed(dq, q, brokered),
+        'to-consumer': elapsed(final, dq, brokered),
+        'end-to-end': elapsed(final, origin, np.ones(len(final), dtype=bool)),
+    }
+    address = records['address'][final]
+    empty = spans.code('')
+    if empty >= 0:
+        address = np.where(address == empty, records['address'][origin], address)
+    return np.array(spans.strings, dtype=object)[address] if len(final) else np.empty(0, dtype=object), result
+
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options] DIRECTORY|FILE...",
+                                   description="Report per-hop message latency from proton_tracing span files.")
+    parser.add_option("-p", "--percentiles", default="50,90,99",
+                      help="comma separated percentiles to report (default %default)")
+    opts, args = parser.parse_args()
+    if not args:
+        parser.error('no span files given')
+    percentiles = [float(p) for p in opts.percentiles.split(',')]
+
+    spans = Spans.load(args)
+    addresses, latency = hops(spans)
+    print('%d spans, %d messages received' % (len(spans.records), len(addresses)))
+    print('%-20s %-12s %8s %s' % ('address', 'hop', 'count', ' '.join('%10s' % ('p%g us' % p) for p in percentiles)))
+    for address in sorted(set(addresses)):
+        of_address = addresses == address
+        for hop in HOPS:
+            values = latency[hop][of_address]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+            print('%-20s %-12s %8d %s' % (address, hop, len(values),
+                                          ' '.join('%10.0f' % v for v in np.percentile(values, percentiles))))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,77 @@
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+
+import math
+import time
+
+
+class TimerWheel(object):
+    """
+    Timer wheel with a slot for every ``tick`` seconds, for timing out large
+    numbers of things at once such as queued messages.
+
+    An entry goes in the slot of the first tick at or after its deadline
+    (in ``time.monotonic()`` seconds) and :meth:`advance` takes the entries
+    from the slots of the ticks that have passed, so adding and expiring are
+    O(1) per entry however many are pending, and entries come out up to one
+    tick late but never early. The slots are kept by tick number, so any
+    deadline fits without the wheel wrapping round.
+
+    There is no cancelling: an entry for something that has gone by the time
+    it comes out is for the caller to ignore.
+    """
+    def __init__(self, tick=0.1):
+        self.tick = tick
+        self.slots = {}
+        self.pending = 0
+        # The last tick whose slot has been emptied
+        self.current = int(time.monotonic() / tick)
+
+    def add(self, deadline, entry):
+        slot = max(int(math.ceil(deadline / self.tick)), self.current + 1)
+        entries = self.slots.get(slot)
+        if entries is None:
+            self.slots[slot] = [entry]
+        else:
+            entries.append(entry)
+        self.pending += 1
+
+    def advance(self, now=None):
+        """
+        :return: the entries whose deadline has passed, earliest slot first
+        """
+        if now is None:
+            now = time.monotonic()
+        tick = int(now / self.tick)
+        if tick <= self.current:
+            return []
+        slots = self.slots
+        if tick - self.current <= len(slots):
+            due = range(self.current + 1, tick + 1)
+        else:
+            # Cheaper than stepping through a long run of empty ticks
+            due = sorted(t for t in slots if t <= tick)
+        self.current = tick
+        expired = []
+        for t in due:
+            entries = slots.pop(t, None)
+            if entries is not None:
+                expired.extend(entries)
+        self.pending -= len(expired)
+        return expired